@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# pylint: disable=invalid-name
+"""
+Benchmark the hot queries before and after the schema upgrade.
+
+Builds a DB with the old schema, status columns stored as enum names,
+no secondary indexes and none of the tables and columns added since,
+shows the query plans and timings of the hot queries, then upgrades it
+in place as create_all_tables does and shows them again.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import importlib
+from datetime import datetime
+
+from sqlalchemy import create_engine, select, func, Enum, MetaData, Table
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
+
+
+# Tables and columns added since the old schema, absent from a DB to upgrade.
+ADDED_TABLES = ('cursors', 'progresssummaries')
+ADDED_COLUMNS = {'users': ('timestamp',),
+                 'diracjobs': ('status_timestamp', 'running_timestamp', 'next_poll')}
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN a query."""
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kwargs):
+    """Compile the EXPLAIN for the dialect."""
+    prefix = 'EXPLAIN QUERY PLAN ' if compiler.dialect.name == 'sqlite' else 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kwargs)
+
+
+def best_of(func_, repeat):
+    """Return the best wall time of repeated calls."""
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func_()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def legacy_metadata(metadata, small_int_enum):
+    """Copy of the table definitions with the old schema."""
+    legacy = MetaData()
+    for table in metadata.sorted_tables:
+        if table.name in ADDED_TABLES:
+            continue
+        # Columns are retyped before joining a table, which fixes their comparators.
+        columns = []
+        for column in table.columns:
+            if column.name in ADDED_COLUMNS.get(table.name, ()):
+                continue
+            column = column.copy()
+            column.index = None
+            if isinstance(column.type, small_int_enum):
+                column.type = Enum(column.type.enum_class)
+            columns.append(column)
+        Table(table.name, legacy, *columns)
+    return legacy
+
+
+def hot_queries(tables, statuses, params):
+    """The hot queries, as run by the web app and monitoring daemon."""
+    users, services = tables['users'], tables['services']
+    requests, parametricjobs, diracjobs = tables['requests'], tables['parametricjobs'], tables['diracjobs']
+    return [('diracjobs status counts',
+             select([diracjobs.c.status, func.count(diracjobs.c.id)])
+             .where(diracjobs.c.parametricjob_id == params['parametricjob_id'])
+             .group_by(diracjobs.c.status)),
+            ('diracjobs to monitor',
+             select([diracjobs.c.id, diracjobs.c.status])
+             .where(diracjobs.c.parametricjob_id == params['parametricjob_id'])
+             .where(diracjobs.c.status.in_(statuses['monitored']))),
+            ('parametricjobs of request',
+             select([parametricjobs.c.id, parametricjobs.c.status])
+             .where(parametricjobs.c.request_id == params['request_id'])),
+            ('approved requests',
+             select([requests.c.id]).where(requests.c.status == statuses['approved'])),
+            ('requests of requester',
+             select([requests.c.id]).where(requests.c.requester_id == params['requester_id'])),
+            ('user by dn and ca',
+             select([users.c.id]).where(users.c.dn == params['dn']).where(users.c.ca == params['ca'])),
+            ('service by name',
+             select([services.c.status]).where(services.c.name == 'DIRAC'))]
+
+
+def status_counts(engine, diracjobs):
+    """The number of DIRAC jobs in each status."""
+    return dict(engine.execute(select([diracjobs.c.status, func.count(diracjobs.c.id)])
+                               .group_by(diracjobs.c.status)).fetchall())
+
+
+def report(engine, queries, repeat):
+    """Print the plan and best time of each query."""
+    for name, query in queries:
+        plan = engine.execute(Explain(query)).fetchall()
+        query_time = best_of(lambda: engine.execute(query).fetchall(), repeat)  # pylint: disable=cell-var-from-loop
+        print "  %-28s %10.3fms" % (name, query_time * 1000.)
+        for row in plan:
+            print "      %s" % ' | '.join(str(value) for value in row)
+
+
+if __name__ == '__main__':
+    lzprod_root = os.path.dirname(
+        os.path.dirname(
+            os.path.expanduser(
+                os.path.expandvars(
+                    os.path.realpath(
+                        os.path.abspath(__file__))))))
+
+    parser = argparse.ArgumentParser(description='Benchmark the hot queries before and after '
+                                                 'the schema upgrade.')
+    parser.add_argument('-n', '--ndiracjobs', default=1000000, type=int,
+                        help="The number of DIRAC jobs [default: %(default)s]")
+    parser.add_argument('-j', '--jobs-per-parametricjob', default=100, type=int,
+                        help="The number of DIRAC jobs per parametric job [default: %(default)s]")
+    parser.add_argument('-p', '--parametricjobs-per-request', default=10, type=int,
+                        help="The number of parametric jobs per request [default: %(default)s]")
+    parser.add_argument('-u', '--nusers', default=500, type=int,
+                        help="The number of users [default: %(default)s]")
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help="The number of timed repetitions [default: %(default)s]")
+    parser.add_argument('-d', '--dburl', default="sqlite://",
+                        help="URL for an empty benchmark DB [default: in memory SQLite]")
+    args = parser.parse_args()
+
+    # Add the python src path to the sys.path for future imports
+    sys.path.append(lzprod_root)
+
+    tables = importlib.import_module('lzproduction.sql.tables')
+    statuses = importlib.import_module('lzproduction.sql.statuses')
+    upgrade_schema = importlib.import_module('lzproduction.sql.migrate').upgrade_schema
+    MONITORED_STATUSES = importlib.import_module('lzproduction.sql.tables.DiracJobs').MONITORED_STATUSES
+    LOCALSTATUS, DIRACSTATUS = statuses.LOCALSTATUS, statuses.DIRACSTATUS
+    metadata = tables.SQLTableBase.metadata
+
+    engine = create_engine(args.dburl)
+    legacy = legacy_metadata(metadata, statuses.SmallIntEnum)
+    legacy.create_all(bind=engine)
+
+    nparametricjobs = max(args.ndiracjobs // args.jobs_per_parametricjob, 1)
+    nrequests = max(nparametricjobs // args.parametricjobs_per_request, 1)
+    ca = '/C=UK/O=eScienceCA/CN=UK e-Science CA 2B'
+    now = datetime.utcnow()
+    print "Populating %i users, %i requests, %i parametric jobs and %i DIRAC jobs..." \
+        % (args.nusers, nrequests, nparametricjobs, args.ndiracjobs)
+    engine.execute(legacy.tables['users'].insert(),
+                   [{'id': i, 'dn': '/C=UK/O=eScience/OU=Imperial/L=Physics/CN=user %i' % i,
+                     'ca': ca, 'email': 'user%i@example.com' % i, 'suspended': False,
+                     'admin': False}
+                    for i in xrange(1, args.nusers + 1)])
+    engine.execute(legacy.tables['services'].insert(),
+                   [{'name': 'DIRAC', 'status': statuses.SERVICESTATUS.Up, 'timestamp': now},
+                    {'name': 'monitoringd', 'status': statuses.SERVICESTATUS.Up, 'timestamp': now}])
+    engine.execute(legacy.tables['requests'].insert(),
+                   [{'id': i, 'requester_id': random.randint(1, args.nusers),
+                     'request_date': '01/01/2017', 'source': 'source', 'detector': 'detector',
+                     'sim_lead': 'sim lead', 'status': random.choice(list(LOCALSTATUS)),
+                     'description': 'benchmark request %i' % i, 'timestamp': now}
+                    for i in xrange(1, nrequests + 1)])
+    engine.execute(legacy.tables['parametricjobs'].insert(),
+                   [{'id': i, 'priority': 3, 'site': 'ANY', 'request_id': i % nrequests + 1,
+                     'status': random.choice(list(LOCALSTATUS)), 'reschedule': False,
+                     'timestamp': now, 'num_completed': 0, 'num_failed': 0,
+                     'num_submitted': 0, 'num_running': 0}
+                    for i in xrange(1, nparametricjobs + 1)])
+    dirac_statuses = list(DIRACSTATUS)
+    batch_size = 10000
+    for first in xrange(1, args.ndiracjobs + 1, batch_size):
+        engine.execute(legacy.tables['diracjobs'].insert(),
+                       [{'id': i, 'parametricjob_id': i % nparametricjobs + 1,
+                         'status': random.choice(dirac_statuses), 'reschedules': 0}
+                        for i in xrange(first, min(first + batch_size, args.ndiracjobs + 1))])
+
+    query_params = {'parametricjob_id': nparametricjobs // 2,
+                    'request_id': nrequests // 2,
+                    'requester_id': args.nusers // 2,
+                    'dn': '/C=UK/O=eScience/OU=Imperial/L=Physics/CN=user %i' % (args.nusers // 2),
+                    'ca': ca}
+    query_statuses = {'monitored': list(MONITORED_STATUSES), 'approved': LOCALSTATUS.Approved}
+
+    print "Before upgrade (best of %i):" % args.repeat
+    report(engine, hot_queries(legacy.tables, query_statuses, query_params), args.repeat)
+
+    counts_before = status_counts(engine, legacy.tables['diracjobs'])
+
+    # As create_all_tables does.
+    start = time.time()
+    metadata.create_all(bind=engine)
+    upgrade_schema(engine, metadata)
+    print "Upgraded schema in %.1fs" % (time.time() - start)
+
+    upgraded = MetaData(bind=engine)
+    upgraded.reflect()
+    for table in metadata.sorted_tables:
+        if set(upgraded.tables[table.name].columns.keys()) != set(table.columns.keys()):
+            sys.exit("Upgraded %s columns differ from the schema" % table.name)
+    users = metadata.tables['users']
+    if engine.execute(select([func.count(users.c.id)])
+                      .where(users.c.timestamp.is_(None))).scalar():
+        sys.exit("Upgraded users have no timestamp")
+    if status_counts(engine, metadata.tables['diracjobs']) != counts_before:
+        sys.exit("Upgraded DIRAC job statuses differ")
+
+    print "After upgrade (best of %i):" % args.repeat
+    report(engine, hot_queries(metadata.tables, query_statuses, query_params), args.repeat)
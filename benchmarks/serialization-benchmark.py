@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# pylint: disable=invalid-name
+"""
+Benchmark the REST table serialization.
+
+Compares serializing the admin request listing through full ORM objects
+and JSONTableEncoder against the column projected RowSerializer.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+from datetime import datetime
+
+
+def best_of(func, repeat):
+    """Return the best wall time of repeated calls."""
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    lzprod_root = os.path.dirname(
+        os.path.dirname(
+            os.path.expanduser(
+                os.path.expandvars(
+                    os.path.realpath(
+                        os.path.abspath(__file__))))))
+
+    parser = argparse.ArgumentParser(description='Benchmark the REST table serialization.')
+    parser.add_argument('-n', '--nrequests', default=20000, type=int,
+                        help="The number of requests to serialize [default: %(default)s]")
+    parser.add_argument('-u', '--nusers', default=50, type=int,
+                        help="The number of distinct requesters [default: %(default)s]")
+    parser.add_argument('-r', '--repeat', default=5, type=int,
+                        help="The number of timed repetitions [default: %(default)s]")
+    parser.add_argument('-d', '--dburl', default="sqlite://",
+                        help="URL for the benchmark DB [default: in memory SQLite]")
+    args = parser.parse_args()
+
+    # Add the python src path to the sys.path for future imports
+    sys.path.append(lzprod_root)
+
+    tables = importlib.import_module('lzproduction.sql.tables')
+    encoder = importlib.import_module('lzproduction.sql.tables.JSONTableEncoder')
+    sql_utils = importlib.import_module('lzproduction.sql.utils')
+    LOCALSTATUS = importlib.import_module('lzproduction.sql.statuses').LOCALSTATUS
+    Users, Requests = tables.Users, tables.Requests
+
+    tables.create_all_tables(args.dburl)
+    with sql_utils.db_session() as session:
+        session.bulk_insert_mappings(Users, [{'id': i,
+                                              'dn': '/C=UK/O=eScience/OU=Imperial/L=Physics/CN=user %i' % i,
+                                              'ca': '/C=UK/O=eScienceCA/CN=UK e-Science CA 2B',
+                                              'email': 'user%i@example.com' % i,
+                                              'suspended': False,
+                                              'admin': False,
+                                              'timestamp': datetime.utcnow()}
+                                             for i in xrange(1, args.nusers + 1)])
+        session.bulk_insert_mappings(Requests, [{'requester_id': i % args.nusers + 1,
+                                                 'request_date': '2017-01-01',
+                                                 'source': 'source %i' % i,
+                                                 'detector': 'detector',
+                                                 'sim_lead': 'sim lead',
+                                                 'status': LOCALSTATUS.Completed,
+                                                 'description': 'benchmark request %i' % i,
+                                                 'timestamp': datetime.utcnow()}
+                                                for i in xrange(args.nrequests)])
+
+    def orm_listing():
+        """Serialize the admin listing through ORM objects."""
+        with sql_utils.db_session() as session:
+            all_requests = session.query(Requests, Users)\
+                                  .join(Users, Requests.requester_id == Users.id)\
+                                  .all()
+            return json.dumps({'data': [dict(request, requester=user.name, status=request.status.name)
+                                        for request, user in all_requests]},
+                              cls=encoder.JSONTableEncoder)
+
+    def projected_listing():
+        """Serialize the admin listing through the RowSerializer."""
+        with sql_utils.db_session() as session:
+            names = {user_id: Users.name_from_dn(dn)
+                     for user_id, dn in session.query(Users.id, Users.dn).all()}
+            serializer = encoder.RowSerializer(Requests,
+                                               requester=lambda row: names[row.requester_id])
+            return serializer.dumps(session.query(*serializer.attributes).all())
+
+    if json.loads(orm_listing()) != json.loads(projected_listing()):
+        sys.exit("Serializations differ!")
+
+    orm_time = best_of(orm_listing, args.repeat)
+    projected_time = best_of(projected_listing, args.repeat)
+    print "Serialized %i requests (best of %i):" % (args.nrequests, args.repeat)
+    print "  ORM + JSONTableEncoder: %8.3fs" % orm_time
+    print "  RowSerializer:          %8.3fs" % projected_time
+    print "  Speed-up:               %8.1fx" % (orm_time / projected_time)
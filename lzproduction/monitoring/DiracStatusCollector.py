@@ -0,0 +1,162 @@
+"""DIRAC status collector."""
+import time
+import logging
+from copy import deepcopy
+from datetime import datetime
+
+from lzproduction.rpc.DiracRPCClient import dirac_api_client, DiracError, DATE_FORMAT
+from lzproduction.utils.collections import list_splitter
+from lzproduction.sql.utils import db_session
+from lzproduction.sql.tables import DiracJobs, ParametricJobs, Cursors
+from lzproduction.sql.tables.DiracJobs import MONITORED_STATUSES, UPDATE_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+MINS = 60
+CURSOR_NAME = 'dirac_status'
+
+
+class DiracStatusCollector(object):
+    """
+    Cycle level DIRAC status collector.
+
+    Gathers the ids of all non-terminal DIRAC jobs belonging to a set of
+    requests that are due to be polled and queries their status from the
+    DIRAC RPC server in large chunks rather than once per ParametricJob.
+
+    In delta mode only the jobs whose status changed since a cursor
+    persisted in the DB are fetched and written straight to the DiracJobs
+    table, with a periodic full resync of all monitored jobs as a safety net.
+    """
+
+    def __init__(self, chunk_size=10000, delta=False, full_resync=60):
+        """
+        Initialisation.
+
+        Args:
+            chunk_size (int): The maximum number of DIRAC job ids sent
+                              in a single RPC status query. DB lookups are
+                              chunked by UPDATE_CHUNK_SIZE.
+            delta (bool): Whether to only fetch status changes.
+            full_resync (int): Time between full resyncs in delta mode (in mins)
+        """
+        self.chunk_size = chunk_size
+        self.delta = delta
+        self.full_resync = full_resync * MINS
+        self._last_resync = time.time()
+
+    def collect(self, request_ids):
+        """
+        Collect the DIRAC statuses for the given requests.
+
+        Args:
+            request_ids (list): The ids of the requests to collect for.
+
+        Returns:
+            dict: The DIRAC status answer for each job id that was
+                  successfully queried and still needs writing. In delta
+                  mode the changes and full resyncs are written here so
+                  this is empty.
+        """
+        if not self.delta:
+            return self._poll(request_ids, due_only=True)
+
+        cursor = self._load_cursor()
+        if cursor is None or time.time() - self._last_resync > self.full_resync:
+            # Take the new cursor before polling so that no change is missed.
+            cursor = self._changes(None)[0]
+            # Written here as update_status only writes the jobs due to be polled.
+            self.apply(self._poll(request_ids, due_only=False))
+            self._save_cursor(cursor)
+            self._last_resync = time.time()
+            return {}
+
+        cursor, changes = self._changes(cursor)
+        self.apply(changes)
+        self._save_cursor(cursor)
+        return {}
+
+    def _poll(self, request_ids, due_only=True):
+        """Query the status of the monitored jobs of the given requests."""
+        if not request_ids:
+            return {}
+
+        dirac_job_ids = []
+        with db_session() as session:
+            for chunk in list_splitter(list(request_ids), UPDATE_CHUNK_SIZE):
+                query = session.query(DiracJobs.id)\
+                               .join(DiracJobs.parametricjob)\
+                               .filter(ParametricJobs.request_id.in_(chunk))\
+                               .filter(DiracJobs.status.in_(MONITORED_STATUSES))
+                if due_only:
+                    query = query.filter(DiracJobs.due_for_poll())
+                dirac_job_ids.extend(job_id for job_id, in query.all())
+
+        start = time.time()
+        dirac_statuses = {}
+        with dirac_api_client() as dirac:
+            for chunk in list_splitter(dirac_job_ids, self.chunk_size):
+                dirac_answer = deepcopy(dirac.status(chunk))
+                if not dirac_answer['OK']:
+                    logger.error("Problem getting status of %i DIRAC jobs: %s",
+                                 len(chunk), dirac_answer['Message'])
+                    continue
+                dirac_statuses.update(dirac_answer['Value'])
+        logger.info("Collected the status of %i/%i DIRAC jobs in %.1fs",
+                    len(dirac_statuses), len(dirac_job_ids), time.time() - start)
+        return dirac_statuses
+
+    def _changes(self, since):
+        """Fetch the DIRAC status changes since the given cursor."""
+        start = time.time()
+        with dirac_api_client() as dirac:
+            dirac_answer = deepcopy(dirac.changed_status(since, self.chunk_size))
+        if not dirac_answer['OK']:
+            raise DiracError(dirac_answer['Message'])
+        changes = dirac_answer['Value']['Status']
+        if since is not None:
+            logger.info("Fetched %i DIRAC status changes since %s in %.1fs",
+                        len(changes), since, time.time() - start)
+        return dirac_answer['Value']['Cursor'], changes
+
+    def apply(self, changes):
+        """
+        Write DIRAC status changes to the DiracJobs table.
+
+        Changes for jobs not in the DB are ignored.
+
+        Args:
+            changes (dict): The DIRAC status answers keyed by job id
+        """
+        now = datetime.utcnow()
+        dirac_jobs = []
+        with db_session() as session:
+            for chunk in list_splitter(list(changes), UPDATE_CHUNK_SIZE):
+                dirac_jobs.extend(session.query(DiracJobs.id,
+                                                DiracJobs.parametricjob_id,
+                                                DiracJobs.status,
+                                                DiracJobs.status_timestamp,
+                                                DiracJobs.running_timestamp)
+                                  .filter(DiracJobs.id.in_(chunk))
+                                  .all())
+        known_ids = set(job.id for job in dirac_jobs)
+        DiracJobs.write_statuses(dirac_jobs,
+                                 {job_id: answer for job_id, answer in changes.iteritems()
+                                  if job_id in known_ids},
+                                 now)
+
+    @staticmethod
+    def _load_cursor():
+        """Load the persisted cursor."""
+        with db_session() as session:
+            cursor = session.query(Cursors.timestamp)\
+                            .filter_by(name=CURSOR_NAME)\
+                            .scalar()
+        return cursor.strftime(DATE_FORMAT) if cursor is not None else None
+
+    @staticmethod
+    def _save_cursor(cursor):
+        """Persist the cursor."""
+        timestamp = datetime.strptime(cursor, DATE_FORMAT)
+        with db_session() as session:
+            if not session.query(Cursors).filter_by(name=CURSOR_NAME).update({'timestamp': timestamp}):
+                session.add(Cursors(name=CURSOR_NAME, timestamp=timestamp))
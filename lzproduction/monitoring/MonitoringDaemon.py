@@ -2,27 +2,87 @@
 import logging
 import time
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import requests
 from daemonize import Daemonize
 
 from lzproduction.utils import logging_utils
+from lzproduction.rpc.DiracRPCClient import connection_pool
 from lzproduction.sql.statuses import LOCALSTATUS, SERVICESTATUS
 from lzproduction.sql.utils import db_session
-from lzproduction.sql.tables import Requests, Services, create_all_tables
+from lzproduction.sql.tables import Requests, Services, ProgressSummaries, create_all_tables
+from .DiracStatusCollector import DiracStatusCollector
+from .Scheduler import Scheduler, Task
 MINS = 60
 
 
 class MonitoringDaemon(Daemonize):
     """Monitoring Daemon."""
 
-    def __init__(self, dburl, delay, cert, verify=False, **kwargs):
-        """Initialisation."""
+    def __init__(self, dburl, delay, cert, verify=False, threads=1, task_timeout=None,
+                 status_chunk_size=10000, rpc_pool_size=10, delta_polling=False,
+                 full_resync=60, submit_delay=1, reschedule_delay=1, submit_threads=4,
+                 reset_chunk_size=1000, db_pool_size=None, db_max_overflow=None, **kwargs):
+        """
+        Initialisation.
+
+        Args:
+            dburl (str): The requests DB url
+            delay (int): The time between service checks and status updates (in mins)
+            cert (tuple): Tuple containing the path to the cert file followed
+                          by the path to the key file as strings.
+            verify (bool/str): Whether to verify the DIRAC server.
+            threads (int): The number of worker threads used to update requests
+                           and parametric jobs concurrently. A value of 1 keeps
+                           the serial behaviour.
+            task_timeout (int): Maximum time (in mins) to wait for any single
+                                request or parametric job update. None means
+                                wait indefinitely.
+            status_chunk_size (int): The maximum number of DIRAC jobs to query
+                                     the status of in a single RPC call.
+            rpc_pool_size (int): The maximum number of simultaneous connections
+                                 to the DIRAC RPC server.
+            delta_polling (bool): Only fetch the DIRAC jobs whose status changed
+                                  since the last cycle.
+            full_resync (int): Time between full status resyncs when delta
+                               polling (in mins).
+            submit_delay (int): The time between checks for newly approved
+                                requests to submit (in mins).
+            reschedule_delay (int): The time between checks for failed requests
+                                    marked for rescheduling, and for requests
+                                    left Submitting to reset (in mins).
+            submit_threads (int): The maximum number of parametric jobs and DIRAC
+                                  submission chunks of a request to submit
+                                  concurrently. A value of 1 submits serially.
+                                  Failed submissions are reset with the same
+                                  concurrency.
+            reset_chunk_size (int): The maximum number of DIRAC jobs to kill and
+                                    delete in a single RPC call when resetting.
+            db_pool_size (int): The number of DB connections kept in the pool.
+                                None uses the default.
+            db_max_overflow (int): The number of DB connections allowed beyond
+                                   the pool size. None uses the default.
+        """
         super(MonitoringDaemon, self).__init__(action=self.main, **kwargs)
         self.dburl = dburl
         self.delay = delay
         self.cert = cert
         self.verify = verify
+        self.threads = threads
+        self.task_timeout = task_timeout * MINS if task_timeout else None
+        self._request_pool = None
+        self._job_pool = None
+        self._collector = DiracStatusCollector(status_chunk_size, delta_polling, full_resync)
+        self.rpc_pool_size = rpc_pool_size
+        self.submit_delay = submit_delay
+        self.reschedule_delay = reschedule_delay
+        self.submit_threads = submit_threads
+        self.reset_chunk_size = reset_chunk_size
+        self.db_pool_size = db_pool_size
+        self.db_max_overflow = db_max_overflow
+        self._scheduler = Scheduler()
+        self._inflight = {}
 
     def exit(self):
         """Update the monitoringd status on exit."""
@@ -51,14 +111,36 @@ class MonitoringDaemon(Daemonize):
 
         # Setup tables within the daemon otherwise the file descriptor
         # will be closed
-        create_all_tables(self.dburl)
+        create_all_tables(self.dburl,
+                          pool_size=self.db_pool_size,
+                          max_overflow=self.db_max_overflow)
+        # From here on the summaries are kept up to date incrementally.
+        ProgressSummaries.rebuild()
+        rpc_pool = connection_pool(max_size=self.rpc_pool_size)
+
+        # Worker threads must also be started within the daemon as they
+        # don't survive the fork.
+        if self.threads > 1:
+            self._request_pool = ThreadPool(self.threads)
+            self._job_pool = ThreadPool(self.threads)
+
+        scheduler = self._scheduler
+        scheduler.schedule(Task('services', self.check_services, self.delay * MINS))
+        scheduler.schedule(Task('submit', self.submit_requests, self.submit_delay * MINS))
+        scheduler.schedule(Task('status', self.monitor_requests, self.delay * MINS))
+        scheduler.schedule(Task('reschedule', self.reschedule_requests, self.reschedule_delay * MINS))
+        scheduler.schedule(Task('reset', self.reset_requests, self.reschedule_delay * MINS))
+        scheduler.schedule(Task('lag-report', scheduler.report_lag, self.delay * MINS, jitter=0.),
+                           self.delay * MINS)
         try:
-            while True:
-                self.check_services()
-                self.monitor_requests()
-                time.sleep(self.delay * MINS)
+            scheduler.run()
         except Exception:
             self.logger.exception("Unhandled exception while running daemon.")
+        finally:
+            for pool in (self._request_pool, self._job_pool):
+                if pool is not None:
+                    pool.terminate()
+            rpc_pool.close()
 
     def check_services(self):
         """
@@ -89,28 +171,141 @@ class MonitoringDaemon(Daemonize):
             else:
                 query_monitoringd.update({'status': SERVICESTATUS.Up})
 
+    def submit_requests(self):
+        """Schedule the submission of newly approved requests."""
+        with db_session() as session:
+            approved_requests = session.query(Requests)\
+                                       .filter_by(status=LOCALSTATUS.Approved)\
+                                       .all()
+            session.expunge_all()
+
+        for request in approved_requests:
+            self._scheduler.schedule(Task('submit-request', self.update_request, args=(request,)))
+
+    def reschedule_requests(self):
+        """Schedule an update of failed requests with ParametricJobs marked for rescheduling."""
+        with db_session() as session:
+            reschedule_requests = session.query(Requests)\
+                                         .filter_by(status=LOCALSTATUS.Failed)\
+                                         .join(Requests.parametricjobs)\
+                                         .filter_by(reschedule=True)\
+                                         .all()
+            session.expunge_all()
+
+        for request in reschedule_requests:
+            self._scheduler.schedule(Task('reschedule-request', self.update_request, args=(request,)))
+
+    def reset_requests(self):
+        """
+        Schedule the reset of requests left Submitting.
+
+        These are requests whose submission failed and whose DIRAC jobs
+        could not all be removed, or whose submission was interrupted by the
+        daemon stopping. Requests still being submitted are skipped as their
+        update is in flight.
+        """
+        with db_session() as session:
+            submitting_requests = session.query(Requests)\
+                                         .filter_by(status=LOCALSTATUS.Submitting)\
+                                         .all()
+            session.expunge_all()
+
+        for request in submitting_requests:
+            self._scheduler.schedule(Task('reset-request', self.update_request, args=(request,)))
+
     def monitor_requests(self):
         """
         Monitor the DB requests.
 
-        Check the status of ongoing DB requests and either update them or
-        create new Ganga tasks for new requests.
+        Collect the DIRAC statuses of all ongoing DB requests and schedule
+        an update of each request. The updates are spread evenly over the
+        first half of the monitoring interval rather than all run at once.
         """
         with db_session() as session:
             monitored_requests = session.query(Requests)\
-                                        .filter(Requests.status.in_((LOCALSTATUS.Approved,
-                                                                     LOCALSTATUS.Submitted,
+                                        .filter(Requests.status.in_((LOCALSTATUS.Submitted,
                                                                      LOCALSTATUS.Running)))\
                                         .all()
-            reschedule_requests = session.query(Requests)\
-                                         .filter_by(status=LOCALSTATUS.Failed)\
-                                         .join(Requests.parametricjobs)\
-                                         .filter_by(reschedule=True)\
-                                         .all()
-            monitored_requests.extend(reschedule_requests)
             session.expunge_all()
 
-        for request in monitored_requests:
+        try:
+            dirac_statuses = self._collector.collect([request.id for request in monitored_requests])
+        except Exception:
+            self.logger.exception("Problem collecting DIRAC statuses, "
+                                  "falling back to per ParametricJob queries.")
+            dirac_statuses = None
+
+        spread = self.delay * MINS / 2. / max(len(monitored_requests), 1)
+        for i, request in enumerate(monitored_requests):
+            self._scheduler.schedule(Task('update-request', self.update_request,
+                                          args=(request, dirac_statuses)),
+                                     i * spread)
+        self.logger.info("Scheduled updates of %i requests", len(monitored_requests))
+
+    def update_request(self, request, dirac_statuses=None):
+        """
+        Dispatch the update of a single request.
+
+        If there is a worker pool the update is handed off to it so as
+        not to hold up the scheduler. A request is not dispatched again while
+        its previous update is still running.
+
+        Args:
+            request (Requests): The request to update
+            dirac_statuses (dict): [Optional] DIRAC status answers collected
+                                   for this monitoring cycle.
+        """
+        if self._request_pool is None:
+            self._update_request(request, dirac_statuses)
+            return
+
+        for request_id, (result, _) in self._inflight.items():
+            if result.ready():
+                del self._inflight[request_id]
+
+        if request.id in self._inflight:
+            _, start = self._inflight[request.id]
+            if self.task_timeout is not None and time.time() - start > self.task_timeout:
+                self.logger.error("Timed out waiting for request %s to update.", request.id)
+            else:
+                self.logger.warning("Request %s is still updating, skipping.", request.id)
+            return
+
+        self._inflight[request.id] = (self._request_pool.apply_async(self._update_request,
+                                                                     (request, dirac_statuses)),
+                                      time.time())
+
+    def _update_request(self, request, dirac_statuses=None):
+        """
+        Submit and/or update a single request.
+
+        Exceptions are logged rather than raised so that one bad request
+        cannot hold up the monitoring of the others.
+
+        Args:
+            request (Requests): The request to update
+            dirac_statuses (dict): [Optional] DIRAC status answers collected
+                                   for this monitoring cycle.
+        """
+        start = time.time()
+        try:
             if request.status == LOCALSTATUS.Approved:
-                request.submit()
-            request.update_status()
+                if not request.submit(concurrency=self.submit_threads,
+                                      reset_chunk_size=self.reset_chunk_size):
+                    return
+            elif request.status == LOCALSTATUS.Submitting:
+                # Left by a submission that failed and couldn't be fully reset,
+                # unless it has since moved on.
+                with db_session() as session:
+                    status = session.query(Requests.status).filter_by(id=request.id).scalar()
+                if status != LOCALSTATUS.Submitting:
+                    return
+                if not request.reset(concurrency=self.submit_threads,
+                                     chunk_size=self.reset_chunk_size):
+                    return
+            request.update_status(dirac_statuses=dirac_statuses,
+                                  pool=self._job_pool,
+                                  timeout=self.task_timeout)
+        except Exception:
+            self.logger.exception("Exception while monitoring request %s", request.id)
+        self.logger.debug("Request %s updated in %.1fs", request.id, time.time() - start)
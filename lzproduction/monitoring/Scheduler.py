@@ -0,0 +1,118 @@
+"""Monitoring task scheduler."""
+import time
+import heapq
+import random
+import logging
+import itertools
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class Task(object):
+    """
+    Scheduled task.
+
+    A task with its own cadence, jitter and failure backoff. Tasks
+    without an interval run only once.
+    """
+
+    def __init__(self, name, action, interval=None, jitter=0.1, max_backoff=None, args=()):
+        """
+        Initialisation.
+
+        Args:
+            name (str): The task type name, used for reporting
+            action (callable): The function to run
+            interval (float): Time between runs (in secs). None for a one-off task
+            jitter (float): Maximum random fractional variation of the interval
+            max_backoff (float): Maximum time between retries of a failing task
+                                 (in secs). Defaults to 8 times the interval.
+            args (tuple): Arguments to pass to the action
+        """
+        self.name = name
+        self.action = action
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff or (8 * interval if interval else None)
+        self.args = args
+        self.failures = 0
+
+    def next_delay(self, failed=False):
+        """
+        Time until the next run.
+
+        The interval is doubled for each consecutive failure up to
+        max_backoff and a random jitter applied.
+
+        Args:
+            failed (bool): Whether the last run failed
+
+        Returns:
+            float: The delay (in secs)
+        """
+        self.failures = self.failures + 1 if failed else 0
+        delay = min(self.interval * 2 ** self.failures, self.max_backoff)
+        return delay * (1. + random.uniform(-self.jitter, self.jitter))
+
+
+class Scheduler(object):
+    """
+    Priority queue task scheduler.
+
+    Keeps a heap of tasks ordered by due time and runs each when it
+    becomes due. The lag between a task's due time and it actually
+    starting is recorded for each task type.
+    """
+
+    def __init__(self):
+        """Initialisation."""
+        self._queue = []
+        self._counter = itertools.count()  # tie breaker keeping FIFO order
+        self._lag = defaultdict(list)
+
+    def __len__(self):
+        """Return the number of scheduled tasks."""
+        return len(self._queue)
+
+    def schedule(self, task, delay=0.):
+        """
+        Schedule a task.
+
+        Args:
+            task (Task): The task to schedule
+            delay (float): Time from now until the task is due (in secs)
+        """
+        heapq.heappush(self._queue, (time.time() + delay, next(self._counter), task))
+
+    def run_next(self):
+        """Wait for the next task to become due and run it."""
+        due, _, task = heapq.heappop(self._queue)
+        wait = due - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        start = time.time()
+        self._lag[task.name].append(start - due)
+        failed = False
+        try:
+            task.action(*task.args)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Exception running scheduled task: %s", task.name)
+            failed = True
+        logger.debug("Task %s ran in %.1fs", task.name, time.time() - start)
+
+        if task.interval is not None:
+            self.schedule(task, task.next_delay(failed))
+
+    def run(self):
+        """Run tasks until none are left."""
+        while self._queue:
+            self.run_next()
+
+    def report_lag(self):
+        """Log the scheduler lag per task type since the last report."""
+        for name, lags in sorted(self._lag.iteritems()):
+            logger.info("Scheduler lag for %i %s task(s): mean %.1fs, max %.1fs",
+                        len(lags), name, sum(lags) / len(lags), max(lags))
+        self._lag.clear()
@@ -4,21 +4,24 @@ $(document).ready(function() {
     // DataTable setup
     /////////////////////////////////////////////////////
     $(".display").each(function(index){
-	$(this).DataTable({ajax: {url: $(this).attr("data-source"),
+	$(this).DataTable({serverSide: true,
+                           processing: true,
+                           ajax: {url: $(this).attr("data-source"),
                                   type: "GET",
                                   cache: true,
+                                  // drop the draw counter so identical polls share a URL and
+                                  // can be answered with 304 Not Modified from the ETag.
+                                  data: function(d) { delete d.draw; },
                                   // cant use success as DataTables uses that but this lets us
                                   // manipulate the data returned from the server prior to drawing.
                                   dataSrc: function(json) {
                                       // setup charts here.
+                                      // the server only returns the current page of rows so
+                                      // the chart is drawn from the status counts of all requests.
                                       var charts_data = {}
                                       // without sort here the order of labels will be first come first serve which will mean that the pie chart will get different colours
-                                      $.each(json.data.sort(function(a,b){return a.status.localeCompare(b.status)}), function(i, row) {
-                                          if (!(row.status in charts_data)){
-                                              charts_data[row.status] = 0;
-                                          }
-                                          charts_data[row.status]++;
-                                          
+                                      $.each(Object.keys(json.statusCounts).sort(), function(i, status) {
+                                          charts_data[status] = json.statusCounts[status];
                                       });
 				      
                                       Chart.defaults.global.maintainAspectRatio = false;
@@ -65,9 +68,45 @@ $(document).ready(function() {
     // Reload table ajax every 5 mins
     /////////////////////////////////////////////////////
     setInterval(function() {
-	$("#tableBody").DataTable().ajax.reload();
+	$("#tableBody").DataTable().ajax.reload(null, false);  // keep the current page
     }, 300000);  // 5 mins
 
+    // Live status updates
+    /////////////////////////////////////////////////////
+    // The server pushes an event for each request or parametric job whose
+    // status changes and only the affected rows on show are patched. Setting
+    // the row data redraws its cells without going back to the server.
+    if (window.EventSource) {
+	var status_events = new EventSource("/events");
+	status_events.onmessage = function(e) {
+	    var event = JSON.parse(e.data);
+	    if (event.parametricjob_id === undefined) {
+		$("#tableBody").DataTable().rows().every(function() {
+		    var data = this.data();
+		    if (data.id == event.request_id && data.status != event.status) {
+			data.status = event.status;
+			this.data(data);
+		    }
+		});
+		return;
+	    }
+	    var subtable = $("#subtable-" + event.request_id);
+	    if (!subtable.length) { return; }
+	    subtable.DataTable().rows().every(function() {
+		var data = this.data();
+		if (data.parametricjob.id == event.parametricjob_id) {
+		    this.data(formatparametricjob($.extend(data.parametricjob,
+							    {status: event.status,
+							     reschedule: event.reschedule,
+							     num_completed: event.counters.completed,
+							     num_failed: event.counters.failed,
+							     num_submitted: event.counters.submitted,
+							     num_running: event.counters.running})));
+		}
+	    });
+	};
+    }
+
     // Custom sort order for request Status field
     /////////////////////////////////////////////////////
     $.fn.dataTable.ext.type.order['request-status-pre'] = function ( d ) {
@@ -169,6 +208,19 @@ $(document).ready(function() {
        return `<span class="glyphicon glyphicon-repeat text-primary reschedule" style="cursor:pointer" macroid="${parametricjob.id}" requestid="${parametricjob.request_id}"></span>`;
     }
 
+    function formatparametricjob(parametricjob){
+	return {'macro': parametricjob.macro,
+		'njobs': parametricjob.njobs,
+		'nevents': parametricjob.nevents,
+		'seed': parametricjob.seed,
+		'output': formatoutput(parametricjob),
+		'status': parametricjob.reschedule? 'Rescheduled': parametricjob.status,
+		'progress': formatprogress(parametricjob),
+		'reschedule': parametricjob.status == 'Failed'? formatreschedule(parametricjob): '',
+		// kept so that status events can patch the row in place.
+		'parametricjob': parametricjob};
+    }
+
     $("#tableBody tbody").on("click", "tr td span.details-control", function() {
 	var datatable = $("#tableBody").DataTable();
 	var tr = $(this).closest("tr");
@@ -179,28 +231,21 @@ $(document).ready(function() {
 	}
 	else{
             row.child($("<table>", {id: "subtable-" + request_id})).show()
-            $("#subtable-" + request_id).DataTable({ajax: {url: '/parametricjobs/' + request_id,
+            $("#subtable-" + request_id).DataTable({serverSide: true,
+                                                    ajax: {url: '/parametricjobs/' + request_id,
                                                            type: "GET",
                                                            cache: true,
+                                                           data: function(d) { delete d.draw; },
                                                            dataSrc: function(json) {
 							       var return_data = new Array();
 							       var data = json.data
 							       for(var i=0;i< data.length; i++){
-								   return_data.push({
-								       'macro': data[i].macro,
-								       'njobs': data[i].njobs,
-								       'nevents': data[i].nevents,
-								       'seed': data[i].seed,
-								       'output': formatoutput(data[i]),
-								       'status': data[i].reschedule? 'Rescheduled': data[i].status,
-								       'progress': formatprogress(data[i]),
-								       'reschedule': data[i].status == 'Failed'? formatreschedule(data[i]): ''
-								   })
+								   return_data.push(formatparametricjob(data[i]));
 							       }
 							       return return_data;
 							   }},
                                                     autoWidth: true,
-                                                    paging: false,
+                                                    lengthChange: false,
                                                     searching: false,
                                                     info: false,
                                                     //columnDefs: [ { defaultContent: "-", data: null, targets: "_all" } ],
@@ -209,9 +254,9 @@ $(document).ready(function() {
 							{ data: 'njobs', title: 'NJobs' },
 							{ data: 'nevents', title: 'NEvents' },
 							{ data: 'seed', title: 'Seed' },
-							{ data: 'output', title: 'Output' },
+							{ data: 'output', title: 'Output', orderable: false },
 							{ data: 'status', title: 'Status' },
-							{ data: 'progress', title: 'Progress' },
+							{ data: 'progress', title: 'Progress', orderable: false },
 							{ data: 'reschedule', orderable: false }
                                                     ],
 						    order: [[5, 'desc']]
@@ -357,15 +402,16 @@ $(document).ready(function() {
     
     $("#contextDelete").click(function() {
 	if ($(this).hasClass("disabled")){ return false; }
-	var ajax_calls = [];
 	var ids = $("#contextmenu").prop("ids");
-	for(var i in ids) {
-            ajax_calls.push($.ajax({url: "/api/" + ids[i],
-                                    type: "DELETE"}));
-	}
-	$.when.apply(this, ajax_calls).done(function() {
-            $("#tableBody").DataTable().ajax.reload();
+	// all of the selected requests are deleted in one go.
+	$.ajax({url: "/api/" + ids.join(","),
+		type: "DELETE"}).done(function() {
+            $("#tableBody").DataTable().ajax.reload(null, false);
             bootstrap_alert("Attention!", "Deleted "+ ids.length +" request(s)", "alert-danger");
+	}).fail(function() {
+            // some requests may have been deleted and the rest kept to retry.
+            $("#tableBody").DataTable().ajax.reload(null, false);
+            bootstrap_alert("Error!", "Not all requests were deleted, try again", "alert-danger");
 	});
     });
     {% endif %}
@@ -379,16 +425,18 @@ $(document).ready(function() {
             if (!selected.length){ return; }
             bootbox.confirm("Really delete " + selected.length + " request(s)?", function(result) {
 		if (!result){ return; }
-		var ajax_calls = []
+		var ids = [];
 		var table = $("#tableBody").DataTable();
 		selected.each(function() {
-		    var id = table.cell($(this), $("td.rowid", this)).data();
-		    ajax_calls.push($.ajax({url: "/api/" + id,
-					    type: "DELETE"}));
+		    ids.push(table.cell($(this), $("td.rowid", this)).data());
 		});
-		$.when.apply(this, ajax_calls).done(function() {
-		    table.ajax.reload();
-		    bootstrap_alert("Attention!", "Deleted " + ajax_calls.length + " requests" , "alert-danger");
+		$.ajax({url: "/api/" + ids.join(","),
+			type: "DELETE"}).done(function() {
+		    table.ajax.reload(null, false);
+		    bootstrap_alert("Attention!", "Deleted " + ids.length + " requests" , "alert-danger");
+		}).fail(function() {
+		    table.ajax.reload(null, false);
+		    bootstrap_alert("Error!", "Not all requests were deleted, try again", "alert-danger");
 		});
             });
 	}
@@ -1,19 +1,196 @@
 """DIRAC RPC Client utilities."""
+import time
+import socket
 import logging
+import threading
+from collections import deque
 from contextlib import contextmanager
 import rpyc
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+class DiracError(Exception):
+    """DIRAC API returned an error."""
+
+    pass
+
+
+class DiracRPCConnectionPool(object):
+    """
+    Thread-safe pool of RPC connections to the DIRAC server.
+
+    Connections are reused between callers rather than opened and closed
+    for every call. Idle connections are kept alive with periodic pings,
+    health checked on checkout and transparently replaced if they have
+    died. The number of connections open at any one time is limited to
+    max_size, further callers block until one is returned.
+    """
+
+    def __init__(self, host='localhost', port=18861, max_size=10, keepalive=60):
+        """
+        Initialisation.
+
+        Args:
+            host (str): The DIRAC RPC server host
+            port (int): The DIRAC RPC server port
+            max_size (int): The maximum number of open connections
+            keepalive (int): Interval in seconds between pings of idle connections
+        """
+        self._address = (host, port)
+        self._max_size = max_size
+        self._keepalive = keepalive
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_size)
+        self._keepalive_thread = None
+
+    def _connect(self):
+        """Open a new connection."""
+        logger.debug("Opening new RPC connection to %s:%s", *self._address)
+        return rpyc.connect(*self._address, config={"allow_public_attrs": True})
+
+    @staticmethod
+    def _close(conn):
+        """Close a connection ignoring errors."""
+        try:
+            conn.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    @staticmethod
+    def _healthy(conn):
+        """Check that a connection is still usable."""
+        if conn.closed:
+            return False
+        try:
+            conn.ping(timeout=10)
+        except Exception:  # pylint: disable=broad-except
+            return False
+        return True
+
+    def _start_keepalive(self):
+        """
+        Start the keep-alive thread.
+
+        This is done lazily on first use so that the thread is started
+        within the daemon process rather than lost on fork.
+        """
+        if self._keepalive_thread is not None and self._keepalive_thread.is_alive():
+            return
+        self._keepalive_thread = threading.Thread(target=self._keepalive_loop,
+                                                  name='DiracRPCKeepAlive')
+        self._keepalive_thread.daemon = True
+        self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        """Ping idle connections dropping any that have died."""
+        while True:
+            time.sleep(self._keepalive)
+            with self._lock:
+                idle = list(self._idle)
+                self._idle.clear()
+            healthy = []
+            for conn, last_used in idle:
+                if self._healthy(conn):
+                    healthy.append((conn, last_used))
+                else:
+                    logger.debug("Dropping dead idle RPC connection.")
+                    self._close(conn)
+            with self._lock:
+                self._idle.extend(healthy)
+
+    def checkout(self):
+        """
+        Checkout a connection from the pool.
+
+        Blocks if max_size connections are already checked out. Connections
+        must be returned with checkin.
+
+        Returns:
+            rpyc.Connection: An open connection to the DIRAC server.
+        """
+        self._semaphore.acquire()
+        try:
+            with self._lock:
+                self._start_keepalive()
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+                if time.time() - last_used < self._keepalive and not conn.closed:
+                    return conn
+                if self._healthy(conn):
+                    return conn
+                logger.debug("Replacing dead RPC connection.")
+                self._close(conn)
+            return self._connect()
+        except:
+            self._semaphore.release()
+            raise
+
+    def checkin(self, conn, discard=False):
+        """
+        Return a connection to the pool.
+
+        Args:
+            conn (rpyc.Connection): The connection to return
+            discard (bool): Close the connection rather than reuse it
+        """
+        try:
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.time()))
+        finally:
+            self._semaphore.release()
+
+    @contextmanager
+    def connection(self):
+        """Context that checks out a connection and returns it afterwards."""
+        conn = self.checkout()
+        discard = False
+        try:
+            yield conn
+        except (EOFError, socket.error):
+            discard = True
+            raise
+        finally:
+            self.checkin(conn, discard)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close(conn)
+
+
+def connection_pool(host="localhost", port=18861, **kwargs):
+    """
+    Get the shared connection pool for a DIRAC RPC server.
+
+    The pool is created on first request with any extra keyword
+    arguments being passed to DiracRPCConnectionPool.
+    """
+    with POOLS_LOCK:
+        pool = POOLS.get((host, port))
+        if pool is None:
+            pool = POOLS[(host, port)] = DiracRPCConnectionPool(host, port, **kwargs)
+        return pool
 
 
 @contextmanager
 def dirac_api_client(host="localhost", port=18861):
     """RPC DIRAC API client context."""
-    conn = rpyc.connect(host, port, config={"allow_public_attrs": True})
-    try:
+    with connection_pool(host, port).connection() as conn:
         yield conn.root.dirac_api
-    finally:
-        conn.close()
 
 
 class ParametricDiracJobClient(object):
@@ -28,15 +205,19 @@ class ParametricDiracJobClient(object):
 
     def __init__(self, host='localhost', port=18861):
         """Initialisation."""
-        self._address = (host, port)
+        self._pool = connection_pool(host, port)
         self._dirac_job_ids = set()
         self._conn = None
         self._job = None
 
     def __enter__(self):
         """Enter context."""
-        self._conn = rpyc.connect(*self._address, config={"allow_public_attrs": True})
-        self._job = self._conn.root.Job()
+        self._conn = self._pool.checkout()
+        try:
+            self._job = self._conn.root.Job()
+        except:
+            self._pool.checkin(self._conn, discard=True)
+            raise
         self._dirac_job_ids.clear()
         return self._job
 
@@ -44,9 +225,10 @@ class ParametricDiracJobClient(object):
         """Exit context."""
         if exc_type is not None:
             logger.error("Error setting up parametric job.")
-            self._conn.close()
+            self._pool.checkin(self._conn, discard=issubclass(exc_type, (EOFError, socket.error)))
             return False
 
+        discard = False
         try:
             result = self._conn.root.dirac_api.submit(self._job)
             if result['OK']:
@@ -59,9 +241,11 @@ class ParametricDiracJobClient(object):
                 logger.error("Problem submitting DIRAC jobs: %s", result['Message'])
         except:
             logger.error("Unknown Error submitting DIRAC parametric job.")
+            discard = True
             raise
         finally:
-            self._conn.close()
+            self._job = None
+            self._pool.checkin(self._conn, discard)
         return False
 
     @property
@@ -1,14 +1,18 @@
 """DIRAC RPC Server."""
 import logging
+from datetime import datetime, timedelta
 #from types import FunctionType
 import rpyc
 from rpyc.utils.server import ThreadedServer
 from daemonize import Daemonize
 from DIRAC.Interfaces.API.Job import Job
 from DIRAC.Interfaces.API.Dirac import Dirac
+from .DiracRPCClient import DATE_FORMAT
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+CURSOR_OVERLAP = timedelta(minutes=5)
+NO_JOBS_SELECTED = 'No jobs selected'  # prefix of DIRAC's selectJobs error for an empty selection
 
 
 #def autoexpose(cls):
@@ -66,6 +70,64 @@ class FixedDirac(Dirac):
             jobid = list(jobid)
         return super(FixedDirac, self).reschedule(jobid)
 
+    def kill(self, jobid):
+        """
+        Kill the given jobs.
+
+        This method does not have an encoder setup for type set
+        let alone rpc type type <netref set>. we intercept the arg here and
+        cast to a list.
+        """
+        if isinstance(jobid, (list, set)):
+            jobid = list(jobid)
+        return super(FixedDirac, self).kill(jobid)
+
+    def delete(self, jobid):
+        """
+        Delete the given jobs.
+
+        This method does not have an encoder setup for type set
+        let alone rpc type type <netref set>. we intercept the arg here and
+        cast to a list.
+        """
+        if isinstance(jobid, (list, set)):
+            jobid = list(jobid)
+        return super(FixedDirac, self).delete(jobid)
+
+    def changed_status(self, since=None, chunk_size=10000):
+        """
+        Return the status of DIRAC jobs whose status changed since a given time.
+
+        Jobs are selected by their LastUpdate time. The returned cursor is the
+        server UTC time at the start of the selection, less a small overlap so
+        that updates committed during the selection are not missed, and should
+        be passed as since in the following call. If since is None only a
+        cursor is returned.
+
+        Args:
+            since (str): UTC time string in the format DATE_FORMAT
+            chunk_size (int): Maximum number of jobs to query the status of at once
+
+        Returns:
+            dict: DIRAC style result with Value {'Cursor': str, 'Status': dict}
+        """
+        cursor = (datetime.utcnow() - CURSOR_OVERLAP).strftime(DATE_FORMAT)
+        statuses = {}
+        if since is not None:
+            result = self.selectJobs(date=since)
+            if not result['OK']:
+                # DIRAC reports an empty selection as an error.
+                if not result['Message'].startswith(NO_JOBS_SELECTED):
+                    return result
+                result = {'OK': True, 'Value': []}
+            jobids = [int(jobid) for jobid in result['Value'] or []]
+            for i in xrange(0, len(jobids), chunk_size):
+                result = self.status(jobids[i:i + chunk_size])
+                if not result['OK']:
+                    return result
+                statuses.update(result['Value'])
+        return {'OK': True, 'Value': {'Cursor': cursor, 'Status': statuses}}
+
 
 class DiracService(rpyc.Service):
     """DIRAC RPyC Service."""
@@ -0,0 +1,171 @@
+"""
+DataTables server-side processing utilities.
+
+Helpers for answering DataTables server-side processing requests,
+pushing the paging, ordering and searching down into SQL so that only
+the requested page of rows is ever loaded and returned.
+"""
+import re
+import logging
+from itertools import count
+from collections import namedtuple
+from sqlalchemy import or_, case, cast, false, String
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+COLUMN_DATA_RE = re.compile(r'^columns\[(\d+)\]\[data\]$')
+MAX_LENGTH = 1000
+
+DataTablesRequest = namedtuple('DataTablesRequest', ('draw', 'start', 'length', 'search', 'order'))
+
+
+def is_server_side(kwargs):
+    """
+    Return whether the query parameters are a DataTables server-side request.
+
+    The draw counter is optional so that clients can drop it to keep the
+    request URL, and so its ETag, stable between identical polls.
+    """
+    return 'start' in kwargs
+
+
+def parse_request(kwargs):
+    """
+    Parse the DataTables server-side request parameters.
+
+    Args:
+        kwargs (dict): The flat query parameters as passed by CherryPy
+
+    Returns:
+        DataTablesRequest: The draw counter (None if not sent), first row, number
+                           of rows, global search term and list of (column data
+                           name, descending) orderings
+    """
+    columns = {}
+    for key, value in kwargs.iteritems():
+        match = COLUMN_DATA_RE.match(key)
+        if match is not None:
+            columns[int(match.group(1))] = value
+
+    order = []
+    for i in count():
+        column = kwargs.get('order[%i][column]' % i)
+        if column is None:
+            break
+        name = columns.get(int(column))
+        if name:
+            order.append((name, kwargs.get('order[%i][dir]' % i, 'asc') == 'desc'))
+
+    length = int(kwargs.get('length', MAX_LENGTH))
+    return DataTablesRequest(draw=int(kwargs['draw']) if 'draw' in kwargs else None,
+                             start=max(int(kwargs.get('start', 0)), 0),
+                             length=MAX_LENGTH if length < 0 else min(length, MAX_LENGTH),
+                             search=kwargs.get('search[value]', '').strip(),
+                             order=order)
+
+
+def like_pattern(term):
+    """
+    Build an escaped LIKE pattern matching strings containing term.
+
+    Use with escape='\\'.
+    """
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def text_search(term, *columns):
+    """
+    Case insensitive substring search over columns.
+
+    Args:
+        term (str): The search term
+        columns (list): The columns to search, non string columns are cast
+
+    Returns:
+        list: The SQL clauses, one per column
+    """
+    pattern = like_pattern(term)
+    return [(column if isinstance(column.type, String) else cast(column, String))
+            .ilike(pattern, escape='\\')
+            for column in columns]
+
+
+def enum_search(term, column, enum_class):
+    """
+    Search an enum column by member name.
+
+    The matching is done in Python so that it is independent of how the
+    enum is stored in the DB.
+
+    Args:
+        term (str): The search term
+        column (Column): The enum column
+        enum_class (Enum): The enum type of the column
+
+    Returns:
+        list: The SQL clause or an empty list if no members match
+    """
+    members = [member for member in enum_class if term.lower() in member.name.lower()]
+    return [column.in_(members)] if members else []
+
+
+def rank(column, ranking, else_=0):
+    """
+    Order a column by an explicit ranking of its values.
+
+    Args:
+        column (Column): The column to order
+        ranking (dict): Mapping of column value to rank
+        else_ (int): The rank of any other value
+
+    Returns:
+        sqlalchemy.sql.expression.Case: The expression to order by
+    """
+    if not ranking:
+        return column
+    # Compare on the column so the values are bound with its type.
+    return case([(column == value, position) for value, position in ranking.iteritems()],
+                else_=else_)
+
+
+def server_side_response(serializer, query, params, search, order, **kwargs):
+    """
+    Answer a DataTables server-side request.
+
+    Args:
+        serializer (RowSerializer): Serializer for the query rows
+        query (sqlalchemy.orm.Query): The query of all rows visible to the user
+        params (DataTablesRequest): The parsed request
+        search (function): Function of the search term returning a list of
+                           SQL clauses any of which a row must match
+        order (dict): Mapping of column data name to the SQL expression to
+                      order by. Names not present can't be ordered on. The
+                      'id' entry, if given, is also used to break ties
+        kwargs (dict): Extra top level entries for the response
+
+    Returns:
+        str: The JSON response
+    """
+    records_total = query.order_by(None).count()
+    records_filtered = records_total
+    if params.search:
+        clauses = search(params.search)
+        query = query.filter(or_(*clauses) if clauses else false())
+        records_filtered = query.order_by(None).count()
+
+    for name, descending in params.order:
+        expression = order.get(name)
+        if expression is None:
+            logger.warning("Ignoring DataTables ordering on unknown column: %s", name)
+            continue
+        query = query.order_by(expression.desc() if descending else expression.asc())
+    if 'id' in order:
+        query = query.order_by(order['id'].asc())
+
+    if params.draw is not None:
+        kwargs['draw'] = params.draw
+    rows = query.offset(params.start).limit(params.length).all()
+    return serializer.dumps(rows,
+                            recordsTotal=records_total,
+                            recordsFiltered=records_filtered,
+                            **kwargs)
@@ -0,0 +1,143 @@
+"""
+Schema migration module.
+
+Bring the schema of an existing DB up to date with the table
+definitions. create_all only creates missing tables, so columns and
+indexes added since the DB was created, and the move of the status
+columns from name strings to small integers, are applied here.
+"""
+import logging
+from sqlalchemy import inspect, case, text, bindparam, select, Integer, MetaData
+from sqlalchemy.sql import table as table_clause, column as column_clause
+from sqlalchemy.schema import CreateTable
+from .statuses import SmallIntEnum
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def _quote(connection, name):
+    """Quote an identifier for the connection's dialect."""
+    return connection.dialect.identifier_preparer.quote(name)
+
+
+def _add_column(connection, table, column):
+    """
+    Add a missing column to a table.
+
+    The column is added as nullable, as most DBs can't add a NOT NULL
+    column to a table with rows, and existing rows are filled with the
+    column default if it has one.
+    """
+    logger.info("Adding column %s.%s", table.name, column.name)
+    connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s'
+                            % (_quote(connection, table.name),
+                               _quote(connection, column.name),
+                               column.type.compile(dialect=connection.dialect))))
+    default = column.default
+    if default is None or not (default.is_callable or default.is_scalar):
+        return
+    value = default.arg(None) if default.is_callable else default.arg
+    connection.execute(text('UPDATE %s SET %s = :value'
+                            % (_quote(connection, table.name),
+                               _quote(connection, column.name)))
+                       .bindparams(bindparam('value', value, type_=column.type)))
+
+
+def _enum_values(column, enum_class):
+    """SQL expression mapping stored member names to member values."""
+    return case([(column == member.name, member.value) for member in enum_class])
+
+
+def _convert_enum_columns(connection, table, columns):
+    """
+    Convert status columns stored as member names to SmallIntEnum.
+
+    SQLite can't drop or alter columns so the table is rebuilt with the
+    new schema and the rows copied across. Other DBs have the values
+    written to a new column that then replaces the old one.
+    """
+    logger.info("Converting %s columns to integers: %s",
+                table.name, ', '.join(column.name for column in columns))
+    old = table_clause(table.name, *(column_clause(column.name) for column in table.columns))
+    quoted_table = _quote(connection, table.name)
+
+    if connection.dialect.name == 'sqlite':
+        # The new table needs the rest of the metadata for its foreign keys.
+        metadata = MetaData()
+        for other in table.metadata.sorted_tables:
+            other.tometadata(metadata)
+        new = table.tometadata(metadata, name=table.name + '_migrate')
+        values = dict((column.name, _enum_values(old.c[column.name], column.type.enum_class))
+                      for column in columns)
+        names = [column.name for column in table.columns]
+        connection.execute(CreateTable(new))
+        connection.execute(new.insert().from_select(names,
+                                                    select([values.get(name, old.c[name])
+                                                            for name in names])))
+        connection.execute(text('DROP TABLE %s' % quoted_table))
+        connection.execute(text('ALTER TABLE %s RENAME TO %s'
+                                % (_quote(connection, new.name), quoted_table)))
+        return
+
+    for column in columns:
+        quoted_column = _quote(connection, column.name)
+        migrate_name = column.name + '_migrate'
+        quoted_migrate = _quote(connection, migrate_name)
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s'
+                                % (quoted_table, quoted_migrate, column_type)))
+        connection.execute(table_clause(table.name, column_clause(migrate_name))
+                           .update()
+                           .values({migrate_name: _enum_values(old.c[column.name],
+                                                               column.type.enum_class)}))
+        connection.execute(text('ALTER TABLE %s DROP COLUMN %s' % (quoted_table, quoted_column)))
+        if connection.dialect.name == 'mysql':
+            connection.execute(text('ALTER TABLE %s CHANGE %s %s %s%s'
+                                    % (quoted_table, quoted_migrate, quoted_column, column_type,
+                                       '' if column.nullable else ' NOT NULL')))
+            continue
+        connection.execute(text('ALTER TABLE %s RENAME COLUMN %s TO %s'
+                                % (quoted_table, quoted_migrate, quoted_column)))
+        if not column.nullable:
+            connection.execute(text('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL'
+                                    % (quoted_table, quoted_column)))
+
+
+def upgrade_schema(engine, metadata):
+    """
+    Upgrade the schema of existing tables.
+
+    Adds missing columns, converts status columns still stored as names
+    to integers and creates missing indexes. Safe to run on an up to
+    date DB, in which case nothing is done.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The DB engine
+        metadata (sqlalchemy.MetaData): The table definitions to upgrade to
+    """
+    table_names = set(inspect(engine).get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        with engine.begin() as connection:
+            inspector = inspect(connection)
+            existing = dict((column['name'], column['type'])
+                            for column in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name not in existing:
+                    _add_column(connection, table, column)
+
+            enum_columns = [column for column in table.columns
+                            if isinstance(column.type, SmallIntEnum)
+                            and column.name in existing
+                            and not isinstance(existing[column.name], Integer)]
+            if enum_columns:
+                _convert_enum_columns(connection, table, enum_columns)
+
+        with engine.begin() as connection:
+            existing = set(index['name'] for index in inspect(connection).get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in existing:
+                    logger.info("Creating index %s", index.name)
+                    index.create(bind=connection)
@@ -1,8 +1,10 @@
 """Status enums for use in SQL tables."""
 from enum import unique, Enum, IntEnum
+from sqlalchemy import SmallInteger
+from sqlalchemy.types import TypeDecorator
 
 
-__all__ = ('SERVICESTATUS', 'DIRACSTATUS', 'LOCALSTATUS')
+__all__ = ('SERVICESTATUS', 'DIRACSTATUS', 'LOCALSTATUS', 'SmallIntEnum')
 
 
 @unique
@@ -68,3 +70,44 @@ STATUS_MAP = {DIRACSTATUS.Unknown: LOCALSTATUS.Unknown,
               DIRACSTATUS.Waiting: LOCALSTATUS.Submitted,
               DIRACSTATUS.Checking: LOCALSTATUS.Submitted,
               DIRACSTATUS.Matched: LOCALSTATUS.Submitted}
+
+
+class SmallIntEnum(TypeDecorator):  # pylint: disable=abstract-method
+    """
+    SQL type storing an IntEnum as its integer value.
+
+    More compact to store and index than the member names used by
+    sqlalchemy's Enum type. Members may also be given by name when
+    binding, as they can be with Enum.
+    """
+
+    impl = SmallInteger
+
+    def __init__(self, enum_class, *args, **kwargs):
+        """
+        Initialisation.
+
+        Args:
+            enum_class (IntEnum): The enum class of the column values
+        """
+        super(SmallIntEnum, self).__init__(*args, **kwargs)
+        self.enum_class = enum_class
+
+    def process_bind_param(self, value, dialect):
+        """Convert an enum member, or its name, to its value."""
+        if value is None:
+            return None
+        if isinstance(value, basestring):
+            return self.enum_class[value].value
+        return self.enum_class(value).value
+
+    def process_result_value(self, value, dialect):
+        """Convert a stored value to its enum member."""
+        if value is None:
+            return None
+        return self.enum_class(int(value))
+
+    @property
+    def python_type(self):
+        """Return the enum class."""
+        return self.enum_class
@@ -0,0 +1,12 @@
+"""Cursors Table."""
+from sqlalchemy import Column, Integer, String, DateTime
+from .SQLTableBase import SQLTableBase
+
+
+class Cursors(SQLTableBase):
+    """Persisted monitoring cursors SQL Table."""
+
+    __tablename__ = 'cursors'
+    id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
+    name = Column(String(25), nullable=False, unique=True)
+    timestamp = Column(DateTime, nullable=False)
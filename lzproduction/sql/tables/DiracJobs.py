@@ -1,61 +1,392 @@
 """Dirac Jobs Table."""
 import logging
 from copy import deepcopy
+from datetime import datetime, timedelta
 from collections import Counter, defaultdict
 
-from sqlalchemy import Column, Integer, Enum, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index, or_, func
 from sqlalchemy.orm import relationship
 
-from lzproduction.rpc.DiracRPCClient import dirac_api_client
+from lzproduction.rpc.DiracRPCClient import dirac_api_client, DiracError
+from lzproduction.utils.collections import subdict, list_splitter
 from ..utils import db_session
-from ..statuses import DIRACSTATUS
+from ..statuses import DIRACSTATUS, STATUS_MAP, SmallIntEnum
 from .SQLTableBase import SQLTableBase
+from .ProgressSummaries import ProgressSummaries
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+MONITORED_STATUSES = frozenset((DIRACSTATUS.Running,
+                                DIRACSTATUS.Received,
+                                DIRACSTATUS.Queued,
+                                DIRACSTATUS.Waiting,
+                                DIRACSTATUS.Checking,
+                                DIRACSTATUS.Matched,
+                                DIRACSTATUS.Unknown,
+                                DIRACSTATUS.Completed))
+# Statuses which only last a short time so are always polled.
+TRANSIENT_STATUSES = frozenset((DIRACSTATUS.Received,
+                                DIRACSTATUS.Checking,
+                                DIRACSTATUS.Matched,
+                                DIRACSTATUS.Unknown,
+                                DIRACSTATUS.Completed))
+POLL_BACKOFF = 0.25  # fraction of the time spent in a state to wait before the next poll
+MAX_POLL_INTERVAL = timedelta(hours=2)
+# Next poll times are rounded down to this so that jobs can be scheduled in bulk.
+POLL_GRANULARITY = timedelta(minutes=1)
+UPDATE_CHUNK_SIZE = 500  # keeps the IN clauses within SQLite's bound parameter limit
+DIRAC_CHUNK_SIZE = 1000  # keeps the kill/delete RPC messages small
+RUNTIME_SAMPLE_SIZE = 100
+
+
+def next_poll_time(status, status_timestamp, running_timestamp=None,
+                   expected_runtime=None, now=None):
+    """
+    Calculate when a DIRAC job should next be polled.
+
+    Jobs in short lived states are polled every cycle. Jobs that have
+    sat in Waiting/Queued/Running have their poll interval backed off
+    in proportion to how long they have been in that state, up to
+    MAX_POLL_INTERVAL. Running jobs are polled again no later than their
+    expected completion time so they are picked up promptly when done.
+
+    Args:
+        status (DIRACSTATUS): The current job status
+        status_timestamp (datetime): When the job entered its current status
+        running_timestamp (datetime): When the job started running
+        expected_runtime (timedelta): Typical runtime of the sibling jobs
+        now (datetime): The current time
+
+    Returns:
+        datetime: The time of the next poll or None if the job should
+                  no longer be polled.
+    """
+    if status not in MONITORED_STATUSES:
+        return None
+    now = now or datetime.utcnow()
+    if status in TRANSIENT_STATUSES or status_timestamp is None:
+        return now
+
+    interval = min(timedelta(seconds=POLL_BACKOFF * (now - status_timestamp).total_seconds()),
+                   MAX_POLL_INTERVAL)
+    if status == DIRACSTATUS.Running and expected_runtime is not None \
+            and running_timestamp is not None:
+        interval = max(min(interval, running_timestamp + expected_runtime - now), timedelta(0))
+    return now + interval
+
+
+def _floor_time(timestamp, granularity=POLL_GRANULARITY):
+    """Round a timestamp down to the granularity, passing None through."""
+    if timestamp is None:
+        return None
+    seconds = granularity.total_seconds()
+    epoch = datetime(1970, 1, 1)
+    return epoch + timedelta(seconds=(timestamp - epoch).total_seconds() // seconds * seconds)
 
 
 class DiracJobs(SQLTableBase):
     """Dirac Jobs SQL Table."""
 
     __tablename__ = 'diracjobs'
+    # Also serves lookups on parametricjob_id alone as its leading column.
+    __table_args__ = (Index('ix_diracjobs_parametricjob_id_status', 'parametricjob_id', 'status'),)
     id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
     parametricjob_id = Column(Integer, ForeignKey('parametricjobs.id'), nullable=False)
     parametricjob = relationship("ParametricJobs", back_populates='diracjobs')
-    status = Column(Enum(DIRACSTATUS), nullable=False, default=DIRACSTATUS.Unknown)
+    status = Column(SmallIntEnum(DIRACSTATUS), nullable=False, default=DIRACSTATUS.Unknown)
     reschedules = Column(Integer, nullable=False, default=0)
+    status_timestamp = Column(DateTime, nullable=True)
+    running_timestamp = Column(DateTime, nullable=True)
+    next_poll = Column(DateTime, nullable=True)
+
+    @staticmethod
+    def due_for_poll(now=None):
+        """SQL clause selecting jobs that are due to be polled."""
+        return or_(DiracJobs.next_poll.is_(None), DiracJobs.next_poll <= (now or datetime.utcnow()))
+
+    @staticmethod
+    def expected_runtime(parametricjob_id):
+        """
+        Typical runtime of the completed jobs of a parametric job.
+
+        Returns:
+            timedelta: The median runtime of a sample of the most recently
+                       completed jobs or None if there are none.
+        """
+        with db_session() as session:
+            runtimes = sorted(done - started for started, done in
+                              session.query(DiracJobs.running_timestamp,
+                                            DiracJobs.status_timestamp)
+                              .filter_by(parametricjob_id=parametricjob_id,
+                                         status=DIRACSTATUS.Done)
+                              .filter(DiracJobs.running_timestamp.isnot(None))
+                              .order_by(DiracJobs.id.desc())
+                              .limit(RUNTIME_SAMPLE_SIZE)
+                              .all())
+        if not runtimes:
+            return None
+        return runtimes[len(runtimes) // 2]
+
+    @staticmethod
+    def dirac_status_counts(parametricjob_id, session):
+        """
+        Count the jobs of a parametric job in each DIRAC status.
+
+        Args:
+            parametricjob_id (int): The id of the parent parametric job
+            session (sqlalchemy.orm.Session): The session to query with
+
+        Returns:
+            Counter: The number of jobs in each DIRACSTATUS
+        """
+        return Counter(dict(session.query(DiracJobs.status, func.count(DiracJobs.id))
+                            .filter_by(parametricjob_id=parametricjob_id)
+                            .group_by(DiracJobs.status)
+                            .all()))
+
+    @staticmethod
+    def request_status_counts(request_id):
+        """
+        Count the jobs of every parametric job of a request in each local status.
+
+        The counting is done in the DB with a GROUP BY on the DIRAC status,
+        rolling up all of the parametric jobs of a request in a single query.
+        Only the resulting counts are mapped to LOCALSTATUS.
+
+        Args:
+            request_id (int): The id of the request
+
+        Returns:
+            dict: A Counter of the number of jobs in each LOCALSTATUS for each
+                  parametric job id. Parametric jobs without DIRAC jobs are absent.
+        """
+        # Avoid circular import
+        from .ParametricJobs import ParametricJobs
+        with db_session() as session:
+            rows = session.query(DiracJobs.parametricjob_id,
+                                 DiracJobs.status,
+                                 func.count(DiracJobs.id))\
+                          .join(DiracJobs.parametricjob)\
+                          .filter(ParametricJobs.request_id == request_id)\
+                          .group_by(DiracJobs.parametricjob_id, DiracJobs.status)\
+                          .all()
+        local_statuses = defaultdict(Counter)
+        for parametricjob_id, status, count in rows:
+            local_statuses[parametricjob_id][STATUS_MAP[status]] += count
+        return dict(local_statuses)
+
+    @staticmethod
+    def _kill_and_delete_chunk(chunk):
+        """
+        Kill and delete a chunk of jobs on DIRAC.
+
+        Never raises so that it can be run in a worker pool. Failing to
+        kill a job is only logged, as finished jobs can't be killed.
+
+        Args:
+            chunk (list): The ids of the DIRAC jobs
+
+        Returns:
+            set: The ids of the jobs DIRAC confirmed deleted
+        """
+        try:
+            with dirac_api_client() as dirac:
+                kill_result = deepcopy(dirac.kill(chunk))
+                delete_result = deepcopy(dirac.delete(chunk))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Exception removing DIRAC jobs %s-%s", chunk[0], chunk[-1])
+            return set()
+        if not kill_result['OK']:
+            logger.warning("Problem killing DIRAC jobs %s-%s: %s",
+                           chunk[0], chunk[-1], kill_result['Message'])
+        if delete_result['OK']:
+            return set(chunk)
+        logger.error("Problem deleting DIRAC jobs %s-%s: %s",
+                     chunk[0], chunk[-1], delete_result['Message'])
+        # DIRAC lists the jobs it couldn't delete when the rest succeeded.
+        failed = set(int(job_id) for key in ('FailedJobIDs', 'NonauthorizedJobIDs')
+                     for job_id in delete_result.get(key, []))
+        return set(chunk).difference(failed) if failed else set()
+
+    @staticmethod
+    def kill_and_delete(dirac_job_ids, chunk_size=DIRAC_CHUNK_SIZE, pool=None):
+        """
+        Kill and delete jobs on DIRAC.
+
+        The ids are sent in chunks so that requests with very many jobs
+        don't hit RPC timeouts or message size limits. Given a pool the
+        chunks are sent concurrently, each over its own RPC connection.
+
+        Args:
+            dirac_job_ids (list): The ids of the DIRAC jobs
+            chunk_size (int): The maximum number of ids per RPC call
+            pool (ThreadPool): [Optional] Worker pool to send the chunks with.
+                               Without one they are sent serially.
+
+        Returns:
+            set: The ids of the jobs DIRAC confirmed deleted
+        """
+        chunks = list(list_splitter(list(dirac_job_ids), chunk_size))
+        if pool is None:
+            results = [DiracJobs._kill_and_delete_chunk(chunk) for chunk in chunks]
+        else:
+            results = [result.get() for result in
+                       [pool.apply_async(DiracJobs._kill_and_delete_chunk, (chunk,))
+                        for chunk in chunks]]
+        return set().union(*results)
 
     @staticmethod
-    def update_status(parametricjob):
+    def delete_jobs(parametricjob_id, dirac_job_ids, session):
+        """
+        Delete DIRAC jobs of a parametric job from the DB.
+
+        The jobs are also removed from the progress summaries.
+
+        Args:
+            parametricjob_id (int): The id of the parent parametric job
+            dirac_job_ids (list): The ids of the DIRAC jobs to delete
+            session (sqlalchemy.orm.Session): The session to delete the jobs in
+        """
+        counts = Counter()
+        for chunk in list_splitter(list(dirac_job_ids), UPDATE_CHUNK_SIZE):
+            jobs = session.query(DiracJobs).filter(DiracJobs.parametricjob_id == parametricjob_id,
+                                                   DiracJobs.id.in_(chunk))
+            counts.update(dict(jobs.with_entities(DiracJobs.status, func.count(DiracJobs.id))
+                               .group_by(DiracJobs.status)
+                               .all()))
+            jobs.delete(synchronize_session=False)
+        ProgressSummaries.apply(session, {parametricjob_id: Counter({status: -count for status, count
+                                                                     in counts.iteritems()})})
+
+    @staticmethod
+    def write_statuses(dirac_jobs, dirac_statuses, now=None):
+        """
+        Write newly polled DIRAC statuses to the DB.
+
+        Records when each job changed status and schedules its next poll.
+        The new statuses are diffed against the current rows so only jobs
+        whose status changed have it written, with one UPDATE per new status.
+        Jobs whose status is unchanged only have their next poll moved on,
+        with one UPDATE per next poll time rounded down to POLL_GRANULARITY.
+        The status changes are also applied to the progress summaries.
+
+        Args:
+            dirac_jobs (list): The current rows of the polled jobs. Each must have
+                               id, parametricjob_id, status, status_timestamp and
+                               running_timestamp attributes.
+            dirac_statuses (dict): The DIRAC status answers keyed by job id
+            now (datetime): The time the statuses were polled
+
+        Returns:
+            dict: The (old status, new status) of each job whose status changed,
+                  keyed by job id
+        """
+        if not dirac_statuses:
+            return {}
+        now = now or datetime.utcnow()
+        old_jobs = {job.id: job for job in dirac_jobs}
+        expected_runtimes = {}
+        transitions = {}
+        summary_deltas = defaultdict(Counter)
+        changed_jobs = defaultdict(list)
+        polled_jobs = defaultdict(list)
+        for job_id, answer in dirac_statuses.iteritems():
+            old_job = old_jobs.get(job_id)
+            if old_job is None:
+                logger.warning("Ignoring status of unknown DIRAC job: %s", job_id)
+                continue
+            status = DIRACSTATUS[answer['Status']]
+            if status != old_job.status:
+                transitions[job_id] = (old_job.status, status)
+                summary_deltas[old_job.parametricjob_id][old_job.status] -= 1
+                summary_deltas[old_job.parametricjob_id][status] += 1
+            if status != old_job.status or old_job.status_timestamp is None:
+                changed_jobs[status].append(job_id)
+                continue
+
+            parametricjob_id = old_job.parametricjob_id
+            if status == DIRACSTATUS.Running and parametricjob_id not in expected_runtimes:
+                expected_runtimes[parametricjob_id] = DiracJobs.expected_runtime(parametricjob_id)
+            polled_jobs[_floor_time(next_poll_time(status,
+                                                   old_job.status_timestamp,
+                                                   old_job.running_timestamp,
+                                                   expected_runtimes.get(parametricjob_id),
+                                                   now))].append(job_id)
+
+        updates = []
+        for status, job_ids in changed_jobs.iteritems():
+            # Having only just changed status these are all due a poll next cycle.
+            values = {'status': status,
+                      'status_timestamp': now,
+                      'next_poll': _floor_time(next_poll_time(status, now, now, None, now))}
+            if status == DIRACSTATUS.Running:
+                values['running_timestamp'] = now
+            updates.append((values, job_ids))
+        updates.extend(({'next_poll': next_poll}, job_ids)
+                       for next_poll, job_ids in polled_jobs.iteritems())
+
+        with db_session() as session:
+            for values, job_ids in updates:
+                for chunk in list_splitter(job_ids, UPDATE_CHUNK_SIZE):
+                    session.query(DiracJobs)\
+                           .filter(DiracJobs.id.in_(chunk))\
+                           .update(values, synchronize_session=False)
+            ProgressSummaries.apply(session, summary_deltas)
+        logger.debug("Wrote %i DIRAC job status changes and %i poll times in %i updates",
+                     sum(len(job_ids) for job_ids in changed_jobs.itervalues()),
+                     sum(len(job_ids) for job_ids in polled_jobs.itervalues()),
+                     len(updates))
+        return transitions
+
+    @staticmethod
+    def update_status(parametricjob, dirac_statuses=None):
         """
         Bulk update status.
 
         This method updates all DIRAC jobs which belong to the given
         parametricjob.
+
+        Args:
+            parametricjob (ParametricJobs): The parent parametric job
+            dirac_statuses (dict): [Optional] DIRAC status answers already collected
+                                   for this monitoring cycle. If given, only jobs
+                                   rescheduled here are queried from DIRAC.
+
+        Returns:
+            Counter: The number of jobs in each LOCALSTATUS
+
+        Only jobs that are due to be polled according to their next_poll
+        time are checked. The returned counts are those read before the
+        update with the written status changes applied, so need no re-read.
         """
+        now = datetime.utcnow()
+        reschedule_statuses = (DIRACSTATUS.Failed, DIRACSTATUS.Stalled)
         with db_session() as session:
-            dirac_jobs = session.query(DiracJobs)\
+            dirac_status_counts = DiracJobs.dirac_status_counts(parametricjob.id, session)
+            # Only load the jobs we might act on, as light weight tuples.
+            dirac_jobs = session.query(DiracJobs.id,
+                                       DiracJobs.parametricjob_id,
+                                       DiracJobs.status,
+                                       DiracJobs.reschedules,
+                                       DiracJobs.status_timestamp,
+                                       DiracJobs.running_timestamp)\
                                 .filter_by(parametricjob_id=parametricjob.id)\
+                                .filter(or_(DiracJobs.status.in_(reschedule_statuses),
+                                            DiracJobs.status.in_(MONITORED_STATUSES)
+                                            & DiracJobs.due_for_poll(now)))\
                                 .all()
-            session.expunge_all()
 
         # Group jobs by status
         job_types = defaultdict(set)
         for job in dirac_jobs:
             job_types[job.status].add(job.id)
             # add auto-reschedule jobs
-            if job.status in (DIRACSTATUS.Failed, DIRACSTATUS.Stalled) and job.reschedules < 2:
+            if job.status in reschedule_statuses and job.reschedules < 2:
                 job_types['Reschedule'].add(job.id)
 
-        reschedule_jobs = job_types['Reschedule'] if job_types[DIRACSTATUS.Done] else set()
-        monitor_jobs = job_types[DIRACSTATUS.Running] | \
-                       job_types[DIRACSTATUS.Received] | \
-                       job_types[DIRACSTATUS.Queued] | \
-                       job_types[DIRACSTATUS.Waiting] | \
-                       job_types[DIRACSTATUS.Checking] | \
-                       job_types[DIRACSTATUS.Matched] | \
-                       job_types[DIRACSTATUS.Unknown] | \
-                       job_types[DIRACSTATUS.Completed]
+        reschedule_jobs = job_types['Reschedule'] if dirac_status_counts[DIRACSTATUS.Done] else set()
+        monitor_jobs = set().union(*(job_types[status] for status in MONITORED_STATUSES))
+        query_jobs = monitor_jobs if dirac_statuses is None else set()
 
         if parametricjob.reschedule:
             reschedule_jobs = job_types[DIRACSTATUS.Failed] | job_types[DIRACSTATUS.Stalled]
@@ -67,6 +398,7 @@ class DiracJobs(SQLTableBase):
             if result['OK']:
                 logger.info("Rescheduled jobs: %s", result['Value'])
                 monitor_jobs.update(result['Value'])
+                query_jobs.update(result['Value'])
                 with db_session(reraise=False) as session:
                     session.query(DiracJobs)\
                            .filter(DiracJobs.id.in_(result['Value']))\
@@ -84,30 +416,30 @@ class DiracJobs(SQLTableBase):
                 logger.error("Problem rescheduling jobs: %s", result['Message'])
 
         # Update status
-        with dirac_api_client() as dirac:
-            dirac_answer = deepcopy(dirac.status(monitor_jobs))
-        if not dirac_answer['OK']:
-            raise DiracError(dirac_answer['Message'])
-        dirac_statuses = dirac_answer['Value']
+        dirac_statuses = subdict(dirac_statuses or {}, monitor_jobs.difference(query_jobs))
+        if query_jobs:
+            with dirac_api_client() as dirac:
+                dirac_answer = deepcopy(dirac.status(query_jobs))
+            if not dirac_answer['OK']:
+                raise DiracError(dirac_answer['Message'])
+            dirac_statuses.update(dirac_answer['Value'])
 
-        skipped_jobs = monitor_jobs.difference(dirac_statuses)
+        # Jobs missing from pre-collected statuses were either unchanged or
+        # already reported by the collector.
+        skipped_jobs = query_jobs.difference(dirac_statuses)
         if skipped_jobs:
             logger.warning("Couldn't check the status of jobs: %s", list(skipped_jobs))
 
-        with db_session() as session:
-#            session.query(DiracJobs)\
-#                   .filter(DiracJobs.id.in_(dirac_statuses.keys()))\
-#                   .update({'status': DIRACSTATUS[dirac_statuses[DiracJobs.id]['Status']]})
-            session.bulk_update_mappings(DiracJobs, [{'id': i, 'status': DIRACSTATUS[j['Status']]}
-                                                      for i, j in dirac_statuses.iteritems()])
-            session.flush()
-            session.expire_all()
-            dirac_jobs = session.query(DiracJobs)\
-                                .filter_by(parametricjob_id=parametricjob.id)\
-                                .all()
-            session.expunge_all()
+        transitions = DiracJobs.write_statuses(dirac_jobs, dirac_statuses, now)
+        for old_status, new_status in transitions.itervalues():
+            dirac_status_counts[old_status] -= 1
+            dirac_status_counts[new_status] += 1
 
-        if not dirac_jobs:
+        local_statuses = Counter()
+        for status, count in dirac_status_counts.iteritems():
+            if count > 0:
+                local_statuses[STATUS_MAP[status]] += count
+        if not local_statuses:
             logger.warning("No dirac jobs associated with parametricjob: %s. returning status unknown", parametricjob.id)
             return Counter([DIRACSTATUS.Unknown.local_status])
-        return Counter(job.status.local_status for job in dirac_jobs)
+        return local_statuses
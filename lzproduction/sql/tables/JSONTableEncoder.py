@@ -1,6 +1,9 @@
 """JSON Utilities Module."""
 import json
 from datetime import datetime
+from itertools import izip
+from operator import attrgetter
+from sqlalchemy import DateTime
 from .SQLTableBase import SQLTableBase
 
 
@@ -13,4 +16,74 @@ class JSONTableEncoder(json.JSONEncoder):
             return dict(obj, status=obj.status.name)
         if isinstance(obj, datetime):
             return obj.isoformat(' ')
-        return super(SQLAlchemyTableEncoder, self).default(obj)
+        return super(JSONTableEncoder, self).default(obj)
+
+
+def _isoformat(value):
+    """Format a datetime as JSONTableEncoder does."""
+    return value.isoformat(' ')
+
+
+class RowSerializer(object):
+    """
+    Fast JSON serializer for column projected query rows.
+
+    Produces the same output as JSONTableEncoder but works on plain row
+    tuples from a query of the table column attributes rather than ORM
+    objects. The column names and the conversion needed for each column
+    are worked out once up front so that serializing is a single pass
+    over the rows.
+    """
+
+    def __init__(self, table, **extras):
+        """
+        Initialisation.
+
+        Args:
+            table (SQLTableBase): The table class whose columns are queried
+            extras (dict): Extra fields to add to each row, mapping the field name
+                           to a function of the row returning its value
+        """
+        self.names = table.columns
+        self.attributes = [getattr(table, name) for name in self.names]
+        self._converters = []
+        for i, column in enumerate(table.__table__.columns):
+            if getattr(column.type, 'enum_class', None) is not None:
+                self._converters.append((i, attrgetter('name')))
+            elif isinstance(column.type, DateTime):
+                self._converters.append((i, _isoformat))
+        self._extras = extras.items()
+
+    def row(self, row):
+        """
+        Convert a row to a JSON serializable dict.
+
+        Args:
+            row (tuple): The query row
+
+        Returns:
+            dict: The row keyed by column name, None if row is None
+        """
+        if row is None:
+            return None
+        values = list(row)
+        for i, converter in self._converters:
+            if values[i] is not None:
+                values[i] = converter(values[i])
+        row_dict = dict(izip(self.names, values))
+        for name, extra in self._extras:
+            row_dict[name] = extra(row)
+        return row_dict
+
+    def dumps(self, rows, **kwargs):
+        """
+        Serialize rows to a JSON DataTables response.
+
+        Args:
+            rows (iterable): The query rows
+            kwargs (dict): Extra top level entries for the response
+
+        Returns:
+            str: The JSON string with the rows under the 'data' key
+        """
+        return json.dumps(dict(kwargs, data=[self.row(row) for row in rows]))
@@ -2,25 +2,27 @@
 import os
 import re
 import time
-import json
 import logging
 import calendar
 from datetime import datetime
+from collections import Counter
 
 import cherrypy
-from sqlalchemy import Column, SmallInteger, Integer, Boolean, String, PickleType, TIMESTAMP, ForeignKey, Enum, CheckConstraint
-from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import Column, SmallInteger, Integer, Boolean, String, PickleType, TIMESTAMP, ForeignKey, CheckConstraint, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
-from lzproduction.rpc.DiracRPCClient import dirac_api_client, ParametricDiracJobClient
+from lzproduction.rpc.DiracRPCClient import ParametricDiracJobClient
 from lzproduction.utils.collections import list_splitter
+from lzproduction.utils.http_utils import resource_etag, conditional_response
 from lzproduction.utils.tempfile_utils import temporary_runscript, temporary_macro
+from .. import datatables
 from ..utils import db_session
-from ..statuses import LOCALSTATUS
+from ..statuses import LOCALSTATUS, DIRACSTATUS, SmallIntEnum
 from .SQLTableBase import SQLTableBase
-from .JSONTableEncoder import JSONTableEncoder
-from .DiracJobs import DiracJobs
+from .JSONTableEncoder import RowSerializer
+from .DiracJobs import DiracJobs, DIRAC_CHUNK_SIZE
+from .ProgressSummaries import ProgressSummaries, PROGRESS_STATUSES, local_column
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -56,24 +58,74 @@ class ParametricJobs(SQLTableBase):
     physics_version = Column(String(250))
     lzap_lfn_inputdir = Column(String(250))
     lzap_lfn_outputdir = Column(String(250))
-    request_id = Column(Integer, ForeignKey('requests.id'), nullable=False)
+    request_id = Column(Integer, ForeignKey('requests.id'), nullable=False, index=True)
     request = relationship("Requests", back_populates="parametricjobs")
-    status = Column(Enum(LOCALSTATUS), nullable=False)
+    status = Column(SmallIntEnum(LOCALSTATUS), nullable=False)
     reschedule = Column(Boolean, nullable=False, default=False)
     timestamp = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # No longer written, the job counts are served from ProgressSummaries.
+    # Kept as existing DBs have them NOT NULL without a server default.
     num_completed = Column(Integer, nullable=False, default=0)
     num_failed = Column(Integer, nullable=False, default=0)
     num_submitted = Column(Integer, nullable=False, default=0)
     num_running = Column(Integer, nullable=False, default=0)
     diracjobs = relationship("DiracJobs", back_populates="parametricjob")
 
-    @hybrid_property
-    def num_other(self):
-        """Return the number of jobs in states other than the known ones."""
-        return self.njobs - (self.num_submitted + self.num_running + self.num_failed + self.num_completed)
+    def _submit_chunk(self, runscript, macro, sublist):
+        """
+        Submit a chunk of the parametric job.
+
+        Args:
+            runscript (str): Path to the runscript
+            macro (str): Path to the macro
+            sublist (list): The seeds of the jobs in this chunk
 
-    def submit(self):
-        """Submit parametric job."""
+        Returns:
+            list: The DIRAC ids of the submitted jobs
+        """
+        start = time.time()
+        parametric_job = ParametricDiracJobClient()
+        with parametric_job as j:
+            j.setName(os.path.splitext(os.path.basename(macro))[0] + '-%(args)s')
+            j.setPriority(self.priority)
+            j.setPlatform('ANY')
+            j.setExecutable(os.path.basename(runscript),
+                            os.path.basename(macro) + ' %(args)s' + ' %s' % self.nevents,
+                            'lzproduction_output.log')
+            j.setInputSandbox([runscript, macro])
+            if self.site.endswith('2Processors'):
+                j.setDestination("LCG.UKI-LT2-IC-HEP.uk")  # this should be done with site, tag = self.site.split(' ')
+                j.setTag('2Processors')
+            elif self.site.endswith("HighMem"):
+                j.setDestination("LCG.UKI-SOUTHGRID-RALPP.uk")
+                j.setTag('HighMem')
+            else:
+                j.setDestination(self.site)
+            j.setBannedSites(['LCG.UKI-LT2-Brunel.uk',
+                              'LCG.UKI-NORTHGRID-LANCS-HEP.uk',
+                              'LCG.UKI-SOUTHGRID-BRIS-HEP.uk',
+                              'VAC.UKI-NORTHGRID-MAN-HEP.uk',
+                              'VAC.UKI-NORTHGRID-LANCS-HEP.uk',
+                              'VAC.UKI-NORTHGRID-LIV-HEP.uk',
+                              'VAC.UKI-SOUTHGRID-BHAM-HEP.uk',
+                              'VAC.UKI-SOUTHGRID-CAM-HEP.uk',
+                              'VAC.UKI-SOUTHGRID-OX-HEP.uk',
+                              'VAC.UKI-SCOTGRID-GLASGOW.uk',
+                              'VAC.UKI-LT2-RHUL.uk',
+                              'VAC.UKI-LT2-UCL-HEP.uk'])
+            j.setParameterSequence('args', sublist, addToWorkflow=False)
+        logger.info("Submitted chunk of %i jobs (seeds %s-%s) for ParametricJob %s in %.1fs",
+                    len(sublist), sublist[0], sublist[-1], self.id, time.time() - start)
+        return parametric_job.subjob_ids
+
+    def submit(self, pool=None):
+        """
+        Submit parametric job.
+
+        Args:
+            pool (multiprocessing.pool.ThreadPool): [Optional] Worker pool used to
+                                                    submit the chunks concurrently.
+        """
         # problems here if not running simulation, there will be no macro so
         # everything including context needs reworking.
 #        lfn_root = os.path.join('/lz/user/l/lzproduser.grid.hep.ph.ic.ac.uk', '_'.join(('-'.join((self.app, self.app_version)),
@@ -99,37 +151,26 @@ class ParametricJobs(SQLTableBase):
                                      livetimeperjob=livetimeperjob, **self) as runscript,\
                  temporary_macro(self.tag, self.macro or '', self.app, self.app_version, self.nevents) as macro:
                 logger.info("Submitting ParametricJob %s, macro: %s to DIRAC", self.id, self.macro)
-                for sublist in list_splitter(range(self.seed, self.seed + self.njobs), 1000):
-                    with parametric_job as j:
-                        j.setName(os.path.splitext(os.path.basename(macro))[0] + '-%(args)s')
-                        j.setPriority(self.priority)
-                        j.setPlatform('ANY')
-                        j.setExecutable(os.path.basename(runscript),
-                                        os.path.basename(macro) + ' %(args)s' + ' %s' % self.nevents,
-                                        'lzproduction_output.log')
-                        j.setInputSandbox([runscript, macro])
-                        if self.site.endswith('2Processors'):
-                            j.setDestination("LCG.UKI-LT2-IC-HEP.uk")  # this should be done with site, tag = self.site.split(' ')
-                            j.setTag('2Processors')
-                        elif self.site.endswith("HighMem"):
-                            j.setDestination("LCG.UKI-SOUTHGRID-RALPP.uk")
-                            j.setTag('HighMem')
-                        else:
-                            j.setDestination(self.site)
-                        j.setBannedSites(['LCG.UKI-LT2-Brunel.uk',
-                                          'LCG.UKI-NORTHGRID-LANCS-HEP.uk',
-                                          'LCG.UKI-SOUTHGRID-BRIS-HEP.uk',
-                                          'VAC.UKI-NORTHGRID-MAN-HEP.uk',
-                                          'VAC.UKI-NORTHGRID-LANCS-HEP.uk',
-                                          'VAC.UKI-NORTHGRID-LIV-HEP.uk',
-                                          'VAC.UKI-SOUTHGRID-BHAM-HEP.uk',
-                                          'VAC.UKI-SOUTHGRID-CAM-HEP.uk',
-                                          'VAC.UKI-SOUTHGRID-OX-HEP.uk',
-                                          'VAC.UKI-SCOTGRID-GLASGOW.uk',
-                                          'VAC.UKI-LT2-RHUL.uk',
-                                          'VAC.UKI-LT2-UCL-HEP.uk'])
-                        j.setParameterSequence('args', sublist, addToWorkflow=False)
-                    dirac_ids.update(parametric_job.subjob_ids)
+                chunks = list_splitter(range(self.seed, self.seed + self.njobs), 1000)
+                if pool is not None:
+                    chunks = [pool.apply_async(self._submit_chunk, (runscript, macro, sublist))
+                              for sublist in chunks]
+
+                # Wait for all chunks, keeping the ids of those that succeeded
+                # so that they are recorded even if another chunk failed.
+                error = None
+                for chunk in chunks:
+                    try:
+                        dirac_ids.update(chunk.get() if pool is not None
+                                         else self._submit_chunk(runscript, macro, chunk))
+                    except Exception as err:  # pylint: disable=broad-except
+                        logger.exception("Exception submitting chunk of ParametricJob %s", self.id)
+                        error = error or err
+                        if pool is None:
+                            break
+                if error is not None:
+                    self._insert_dirac_jobs(dirac_ids)
+                    raise error
         else:
             with temporary_runscript(root_version='5.34.32',
                                      root_arch='slc6_gcc44_x86_64',
@@ -172,62 +213,143 @@ class ParametricJobs(SQLTableBase):
 
                 dirac_ids.update(parametric_job.subjob_ids)
 
+        self._insert_dirac_jobs(dirac_ids)
+
+    def _insert_dirac_jobs(self, dirac_ids):
+        """Bulk insert newly submitted DIRAC jobs."""
         with db_session() as session:
             session.bulk_insert_mappings(DiracJobs, [{'id': i, 'parametricjob_id': self.id}
                                                      for i in dirac_ids])
+            ProgressSummaries.apply(session, {self.id: Counter({DIRACSTATUS.Unknown: len(dirac_ids)})})
+
+    def reset(self, pool=None, chunk_size=DIRAC_CHUNK_SIZE):
+        """
+        Reset parametric job.
 
-    def reset(self):
-        """Reset parametric job."""
+        The DIRAC jobs are killed and deleted on DIRAC in chunks, sent
+        concurrently if given a pool. Only the jobs DIRAC confirmed deleted
+        are removed from the DB, so resetting again after a partial failure
+        only retries the remaining jobs.
+
+        Args:
+            pool (ThreadPool): [Optional] Worker pool to send the chunks with.
+            chunk_size (int): The maximum number of DIRAC job ids per RPC call.
+
+        Returns:
+            bool: Whether all of the DIRAC jobs were removed.
+        """
+        dirac_job_ids = []
         with db_session(reraise=False) as session:
-            dirac_jobs = session.query(DiracJobs).filter_by(parametricjob_id=self.id)
-            dirac_job_ids = [j.id for j in dirac_jobs.all()]
-            dirac_jobs.delete(synchronize_session=False)
-        with dirac_api_client() as dirac:
-            logger.info("Removing Dirac jobs %s from ParametricJob %s", dirac_job_ids, self.id)
-            dirac.kill(dirac_job_ids)
-            dirac.delete(dirac_job_ids)
-
-
-    def delete_dirac_jobs(self, session):
-        """Delete associated DIRAC jobs."""
-        logger.info("Deleting DiracJobs for ParametricJob id: %s", self.id)
-        session.query(DiracJobs)\
-               .filter_by(parametricjob_id=self.id)\
-               .delete(synchronize_session=False)
-
-    def update_status(self):
-        """Update the status of parametric job."""
-        local_statuses = DiracJobs.update_status(self)
-        # could just have DiracJobs return this... maybe better
-#        local_statuses = Counter(status.local_status for status in dirac_statuses.elements())
+            dirac_job_ids = [job_id for (job_id,) in session.query(DiracJobs.id)
+                             .filter_by(parametricjob_id=self.id)
+                             .all()]
+        if not dirac_job_ids:
+            return True
+
+        logger.info("Removing %i Dirac jobs from ParametricJob %s", len(dirac_job_ids), self.id)
+        start = time.time()
+        confirmed = DiracJobs.kill_and_delete(dirac_job_ids, chunk_size, pool)
+        with db_session(reraise=False) as session:
+            DiracJobs.delete_jobs(self.id, confirmed, session)
+
+        if len(confirmed) < len(dirac_job_ids):
+            logger.error("Failed to remove %i of %i Dirac jobs from ParametricJob %s, "
+                         "resetting again will retry them",
+                         len(dirac_job_ids) - len(confirmed), len(dirac_job_ids), self.id)
+            return False
+        logger.info("Removed %i Dirac jobs from ParametricJob %s in %.1fs",
+                    len(dirac_job_ids), self.id, time.time() - start)
+        return True
+
+    def update_status(self, dirac_statuses=None):
+        """
+        Update the status of parametric job.
+
+        Args:
+            dirac_statuses (dict): [Optional] DIRAC status answers already
+                                   collected for this monitoring cycle.
+        """
+        return self.set_status(DiracJobs.update_status(self, dirac_statuses))
+
+    def set_status(self, local_statuses):
+        """
+        Set the status of the parametric job.
+
+        The job counts are kept in ProgressSummaries so the row is only
+        written if the status changed or a reschedule was handled.
+
+        Args:
+            local_statuses (Counter): The number of DIRAC jobs in each LOCALSTATUS
+
+        Returns:
+            LOCALSTATUS: The new status of the parametric job
+        """
         status = max(local_statuses or [self.status])
-        with db_session() as session:
-            this = session.merge(self)
-            this.status = status
-            this.num_completed = local_statuses[LOCALSTATUS.Completed]
-            this.num_failed = local_statuses[LOCALSTATUS.Failed]
-            this.num_submitted = local_statuses[LOCALSTATUS.Submitted]
-            this.num_running = local_statuses[LOCALSTATUS.Running]
-            this.reschedule = False
+        if status != self.status or self.reschedule:
+            with db_session() as session:
+                session.query(ParametricJobs)\
+                       .filter_by(id=self.id)\
+                       .update({'status': status, 'reschedule': False},
+                               synchronize_session=False)
         return status
 
 
     @staticmethod
-    def GET(reqid):  # pylint: disable=invalid-name
+    def GET(reqid, **kwargs):  # pylint: disable=invalid-name
         """
         REST Get method.
 
-        Returns all ParametricJobs for a given request id.
+        Returns all ParametricJobs for a given request id. If called
+        with DataTables server-side processing parameters then only the
+        requested page of ParametricJobs is returned. Answers If-None-Match
+        with 304 Not Modified if the ParametricJobs are unchanged.
         """
         logger.debug("In GET: reqid = %s", reqid)
         requester = cherrypy.request.verified_user
         with db_session() as session:
-            user_requests = session.query(ParametricJobs)\
-                                   .filter_by(request_id=reqid)
+            count, latest = session.query(func.count(ParametricJobs.id), func.max(ParametricJobs.timestamp))\
+                                   .filter(ParametricJobs.request_id == reqid)\
+                                   .one()
+            # The job counts change with the progress summaries.
+            counts_latest = session.query(func.max(ProgressSummaries.timestamp))\
+                                   .filter(ProgressSummaries.request_id == reqid)\
+                                   .scalar()
+        version = (count, max([timestamp for timestamp in (latest, counts_latest)
+                               if timestamp is not None] or [None]))
+        etag = resource_etag(version, requester.id, requester.admin, reqid, sorted(kwargs.iteritems()))
+        return conditional_response(etag, lambda: ParametricJobs._get(requester, reqid, kwargs))
+
+    @staticmethod
+    def _get(requester, reqid, kwargs):
+        """Render the REST Get response."""
+        # The job counts come from the progress summaries, absent before submission.
+        serializer = RowSerializer(ParametricJobs,
+                                   **{'num_' + status.name.lower():
+                                      (lambda row, name=local_column(status): getattr(row, name) or 0)
+                                      for status in PROGRESS_STATUSES})
+        with db_session() as session:
+            user_requests = session.query(*(serializer.attributes
+                                            + [getattr(ProgressSummaries, local_column(status))
+                                               for status in PROGRESS_STATUSES]))\
+                                   .outerjoin(ProgressSummaries,
+                                              ProgressSummaries.parametricjob_id == ParametricJobs.id)\
+                                   .filter(ParametricJobs.request_id == reqid)
             if not requester.admin:
                 user_requests = user_requests.join(ParametricJobs.request)\
                                              .filter_by(requester_id=requester.id)
-            return json.dumps({'data': user_requests.all()}, cls=JSONTableEncoder)
+            if datatables.is_server_side(kwargs):
+                order = {'id': ParametricJobs.id,
+                         'macro': ParametricJobs.macro,
+                         'njobs': ParametricJobs.njobs,
+                         'nevents': ParametricJobs.nevents,
+                         'seed': ParametricJobs.seed,
+                         'status': ParametricJobs.status}
+                search = lambda term: (datatables.text_search(term, ParametricJobs.macro)
+                                       + datatables.enum_search(term, ParametricJobs.status, LOCALSTATUS))
+                return datatables.server_side_response(serializer, user_requests,
+                                                       datatables.parse_request(kwargs),
+                                                       search, order)
+            return serializer.dumps(user_requests.all())
 
     @staticmethod
     def PUT(jobid, reschedule=False):  # pylint: disable=invalid-name
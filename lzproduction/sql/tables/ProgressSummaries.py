@@ -0,0 +1,212 @@
+"""Progress Summaries Table."""
+import logging
+from datetime import datetime
+from collections import Counter, defaultdict
+from sqlalchemy import Column, Integer, ForeignKey, TIMESTAMP, func
+from lzproduction.utils.collections import list_splitter
+from ..utils import db_session
+from ..statuses import DIRACSTATUS, LOCALSTATUS, STATUS_MAP
+from .SQLTableBase import SQLTableBase
+
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+QUERY_CHUNK_SIZE = 500  # keeps the IN clauses within SQLite's bound parameter limit
+# The LOCALSTATUS counts shown on the web UI progress bars.
+PROGRESS_STATUSES = (LOCALSTATUS.Completed, LOCALSTATUS.Failed, LOCALSTATUS.Submitted, LOCALSTATUS.Running)
+
+
+def dirac_column(status):
+    """Name of the column counting jobs in a DIRACSTATUS."""
+    return 'dirac_' + status.name.lower()
+
+
+def local_column(status):
+    """Name of the column counting jobs in a LOCALSTATUS."""
+    return 'local_' + status.name.lower()
+
+
+class ProgressSummaries(SQLTableBase):
+    """
+    Progress Summaries SQL Table.
+
+    Materialised counts of the DIRAC jobs in each DIRACSTATUS and
+    LOCALSTATUS. There is a row for each parametric job and one for each
+    request, with a NULL parametricjob_id, holding the totals over its
+    parametric jobs. The counts are kept up to date incrementally from
+    the DIRAC jobs inserted, deleted and changing status.
+    """
+
+    __tablename__ = 'progresssummaries'
+    id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
+    request_id = Column(Integer, ForeignKey('requests.id'), nullable=False, index=True)
+    parametricjob_id = Column(Integer, ForeignKey('parametricjobs.id'), nullable=True, unique=True)
+    requester_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    timestamp = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def count_columns():
+        """Return the count column attributes, DIRAC statuses first."""
+        return [getattr(ProgressSummaries, dirac_column(status)) for status in DIRACSTATUS]\
+            + [getattr(ProgressSummaries, local_column(status)) for status in LOCALSTATUS]
+
+    @staticmethod
+    def counts(values):
+        """
+        Convert count column values to a JSON serializable dict.
+
+        Args:
+            values (list): The values of the count columns in the order of count_columns,
+                           or an empty list for all zero
+
+        Returns:
+            dict: The counts keyed by status name under 'dirac' and 'local'
+        """
+        ndirac = len(DIRACSTATUS)
+        values = [int(value or 0) for value in values] or [0] * (ndirac + len(LOCALSTATUS))
+        return {'dirac': {status.name: value for status, value in zip(DIRACSTATUS, values[:ndirac])},
+                'local': {status.name: value for status, value in zip(LOCALSTATUS, values[ndirac:])}}
+
+    @staticmethod
+    def _count_values(dirac_counts):
+        """Map counts of jobs in each DIRACSTATUS to count column values."""
+        local_counts = Counter()
+        values = {}
+        for status, count in dirac_counts.iteritems():
+            if count:
+                values[dirac_column(status)] = count
+                local_counts[STATUS_MAP[status]] += count
+        for status, count in local_counts.iteritems():
+            if count:
+                values[local_column(status)] = count
+        return values
+
+    @staticmethod
+    def _owners(session, parametricjob_ids):
+        """Look up the request and requester ids of parametric jobs."""
+        # Avoid circular import
+        from .ParametricJobs import ParametricJobs
+        from .Requests import Requests
+        owners = []
+        for chunk in list_splitter(list(parametricjob_ids), QUERY_CHUNK_SIZE):
+            owners.extend(session.query(ParametricJobs.id,
+                                        ParametricJobs.request_id,
+                                        Requests.requester_id)
+                          .join(ParametricJobs.request)
+                          .filter(ParametricJobs.id.in_(chunk))
+                          .all())
+        return owners
+
+    @staticmethod
+    def ensure(session, request_id, requester_id, parametricjob_ids):
+        """
+        Create any missing summary rows of a request, with zero counts.
+
+        Done before the parametric jobs are submitted, which may be
+        concurrently, so that their updates never race to create rows.
+
+        Args:
+            session (sqlalchemy.orm.Session): The session to add the rows in
+            request_id (int): The request id
+            requester_id (int): The id of the requesting user
+            parametricjob_ids (list): The ids of the request's parametric jobs
+        """
+        existing = set(parametricjob_id for (parametricjob_id,) in
+                       session.query(ProgressSummaries.parametricjob_id)
+                       .filter_by(request_id=request_id)
+                       .all())
+        for parametricjob_id in [None] + list(parametricjob_ids):
+            if parametricjob_id not in existing:
+                session.add(ProgressSummaries(request_id=request_id,
+                                              parametricjob_id=parametricjob_id,
+                                              requester_id=requester_id))
+
+    @staticmethod
+    def apply(session, dirac_deltas):
+        """
+        Apply changes in the number of DIRAC jobs in each status.
+
+        Updates the rows of the parametric jobs and their requests, creating
+        any missing ones as a fallback. Should be called in the same session as
+        the DiracJobs changes so that the summaries are never out of step.
+
+        Args:
+            session (sqlalchemy.orm.Session): The session the DiracJobs were changed in
+            dirac_deltas (dict): Counter of the change in the number of jobs in
+                                 each DIRACSTATUS keyed by parametric job id
+        """
+        dirac_deltas = {parametricjob_id: delta for parametricjob_id, delta in dirac_deltas.iteritems()
+                        if any(delta.itervalues())}
+        if not dirac_deltas:
+            return
+        request_deltas = defaultdict(Counter)
+        for parametricjob_id, request_id, requester_id in ProgressSummaries._owners(session, dirac_deltas):
+            delta = dirac_deltas[parametricjob_id]
+            ProgressSummaries._add(session, request_id, parametricjob_id, requester_id, delta)
+            request_deltas[(request_id, requester_id)].update(delta)
+        for (request_id, requester_id), delta in request_deltas.iteritems():
+            ProgressSummaries._add(session, request_id, None, requester_id, delta)
+
+    @staticmethod
+    def _add(session, request_id, parametricjob_id, requester_id, dirac_delta):
+        """Add to the counts of a summary row, creating it if needed."""
+        values = ProgressSummaries._count_values(dirac_delta)
+        if not values:
+            return
+        updated = session.query(ProgressSummaries)\
+                         .filter_by(request_id=request_id, parametricjob_id=parametricjob_id)\
+                         .update({name: getattr(ProgressSummaries, name) + value
+                                  for name, value in values.iteritems()},
+                                 synchronize_session=False)
+        if not updated:
+            logger.warning("Creating missing progress summary of request %s, parametric job %s",
+                           request_id, parametricjob_id)
+            session.add(ProgressSummaries(request_id=request_id,
+                                          parametricjob_id=parametricjob_id,
+                                          requester_id=requester_id,
+                                          **values))
+            session.flush()
+
+    @staticmethod
+    def rebuild():
+        """
+        Recompute all of the summaries from the DiracJobs table.
+
+        Used at start up to initialise the table and correct any drift,
+        e.g. from changes made outside of the monitoring daemon.
+        """
+        # Avoid circular import
+        from .DiracJobs import DiracJobs
+        with db_session() as session:
+            dirac_counts = defaultdict(Counter)
+            for parametricjob_id, status, count in session.query(DiracJobs.parametricjob_id,
+                                                                 DiracJobs.status,
+                                                                 func.count(DiracJobs.id))\
+                                                          .group_by(DiracJobs.parametricjob_id,
+                                                                    DiracJobs.status)\
+                                                          .all():
+                dirac_counts[parametricjob_id][status] = count
+
+            request_counts = defaultdict(Counter)
+            mappings = []
+            for parametricjob_id, request_id, requester_id in ProgressSummaries._owners(session, dirac_counts):
+                request_counts[(request_id, requester_id)].update(dirac_counts[parametricjob_id])
+                mappings.append(dict(ProgressSummaries._count_values(dirac_counts[parametricjob_id]),
+                                     request_id=request_id,
+                                     parametricjob_id=parametricjob_id,
+                                     requester_id=requester_id))
+            mappings.extend(dict(ProgressSummaries._count_values(counts),
+                                 request_id=request_id,
+                                 parametricjob_id=None,
+                                 requester_id=requester_id)
+                            for (request_id, requester_id), counts in request_counts.iteritems())
+
+            session.query(ProgressSummaries).delete(synchronize_session=False)
+            session.bulk_insert_mappings(ProgressSummaries, mappings)
+        logger.info("Rebuilt progress summaries of %i parametric jobs and %i requests",
+                    len(dirac_counts), len(request_counts))
+
+
+for _status in DIRACSTATUS:
+    setattr(ProgressSummaries, dirac_column(_status), Column(Integer, nullable=False, default=0))
+for _status in LOCALSTATUS:
+    setattr(ProgressSummaries, local_column(_status), Column(Integer, nullable=False, default=0))
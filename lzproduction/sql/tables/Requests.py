@@ -1,22 +1,38 @@
 """Requests Table."""
 import json
+import time
 import logging
 from datetime import datetime
+from collections import Counter, defaultdict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
 import cherrypy
-from sqlalchemy import Column, Integer, String, TIMESTAMP, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, TIMESTAMP, ForeignKey, select, func
 from sqlalchemy.orm import relationship
 
 from lzproduction.utils.collections import subdict
+from lzproduction.utils.http_utils import resource_etag, conditional_response
+from .. import datatables
 from ..utils import db_session
-from ..statuses import LOCALSTATUS
+from ..statuses import LOCALSTATUS, SmallIntEnum
 from .SQLTableBase import SQLTableBase
-from .JSONTableEncoder import JSONTableEncoder
+from .JSONTableEncoder import RowSerializer
 from .Users import Users
 from .ParametricJobs import ParametricJobs
+from .DiracJobs import DiracJobs, DIRAC_CHUNK_SIZE
+from .ProgressSummaries import ProgressSummaries
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+DELETE_THREADS = 4  # concurrent kill/delete RPC calls when deleting requests
+# Display ordering of request statuses, as used by the web front end.
+STATUS_ORDER = {LOCALSTATUS.Requested: 1,
+                LOCALSTATUS.Approved: 2,
+                LOCALSTATUS.Submitted: 3,
+                LOCALSTATUS.Running: 4,
+                LOCALSTATUS.Failed: 5,
+                LOCALSTATUS.Completed: 6}
 
 
 @cherrypy.expose
@@ -25,57 +41,242 @@ class Requests(SQLTableBase):
 
     __tablename__ = 'requests'
     id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
-    requester_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    requester_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     request_date = Column(String(250), nullable=False)
     source = Column(String(250), nullable=False)
     detector = Column(String(250), nullable=False)
     sim_lead = Column(String(250), nullable=False)
-    status = Column(Enum(LOCALSTATUS), nullable=False, default=LOCALSTATUS.Requested)
+    status = Column(SmallIntEnum(LOCALSTATUS), nullable=False, default=LOCALSTATUS.Requested, index=True)
     description = Column(String(250), nullable=False)
     timestamp = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     parametricjobs = relationship("ParametricJobs", back_populates="request")
 
-    def submit(self):
-        """Submit Request."""
+    def submit(self, concurrency=1, reset_chunk_size=DIRAC_CHUNK_SIZE):
+        """
+        Submit Request.
+
+        If submission fails the request is reset, with the same concurrency.
+
+        Args:
+            concurrency (int): [Optional] The maximum number of ParametricJobs and of
+                               DIRAC submission or removal chunks to handle concurrently.
+            reset_chunk_size (int): [Optional] The maximum number of DIRAC jobs to kill
+                                    and delete in a single RPC call when resetting.
+
+        Returns:
+            bool: False if the submission failed and not all of its DIRAC jobs could
+                  be removed. The request is then left Submitting to be reset again.
+        """
         with db_session() as session:
             parametricjobs = session.query(ParametricJobs).filter_by(request_id=self.id).all()
             session.expunge_all()
             session.merge(self).status = LOCALSTATUS.Submitting
+            ProgressSummaries.ensure(session, self.id, self.requester_id,
+                                     [job.id for job in parametricjobs])
 
         logger.info("Submitting request %s", self.id)
 
-        submitted_jobs = []
-        try:
+        start = time.time()
+        if concurrency <= 1:
+            try:
+                for job in parametricjobs:
+                    job.submit()
+            except:
+                logger.exception("Exception while submitting request %s", self.id)
+                return self.reset(concurrency, reset_chunk_size)
+        else:
+            # Separate pools for the ParametricJobs and their chunks so that
+            # a ParametricJob waiting on its chunks can never starve them.
+            job_pool = ThreadPool(min(concurrency, len(parametricjobs)) or 1)
+            chunk_pool = ThreadPool(concurrency)
+            try:
+                results = [(job, job_pool.apply_async(job.submit, kwds={'pool': chunk_pool}))
+                           for job in parametricjobs]
+                failed = False
+                for job, result in results:
+                    try:
+                        result.get()
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception("Exception while submitting ParametricJob %s of request %s",
+                                         job.id, self.id)
+                        failed = True
+            finally:
+                job_pool.terminate()
+                chunk_pool.terminate()
+            if failed:
+                return self.reset(concurrency, reset_chunk_size)
+
+        # Only requests whose submission failed or was interrupted stay Submitting.
+        with db_session() as session:
+            session.merge(self).status = LOCALSTATUS.Submitted
+        logger.info("Submitted request %s in %.1fs", self.id, time.time() - start)
+        return True
+
+    def reset(self, concurrency=1, chunk_size=DIRAC_CHUNK_SIZE):
+        """
+        Reset the ParametricJobs of the request, removing their DIRAC jobs.
+
+        Args:
+            concurrency (int): [Optional] The maximum number of ParametricJobs and of
+                               DIRAC removal chunks to handle concurrently.
+            chunk_size (int): [Optional] The maximum number of DIRAC jobs to kill
+                              and delete in a single RPC call.
+
+        Returns:
+            bool: Whether all of the DIRAC jobs were removed. If not, resetting
+                  again only retries the remaining jobs.
+        """
+        with db_session() as session:
+            parametricjobs = session.query(ParametricJobs).filter_by(request_id=self.id).all()
+            session.expunge_all()
+
+        logger.info("Resetting request %s", self.id)
+        start = time.time()
+        incomplete = []
+        if concurrency <= 1:
             for job in parametricjobs:
-                job.submit()
-                submitted_jobs.append(job)
-        except:
-            logger.exception("Exception while submitting request %s", self.id)
-            logger.info("Resetting associated ParametricJobs")
-            for job in submitted_jobs:
-                job.reset()
-
-
-    def delete_parametric_jobs(self, session):
-        """Delete associated ParametricJob jobs."""
-        logger.info("Deleting ParametricJobs for Request id: %s", self.id)
-        parametric_jobs = session.query(ParametricJobs)\
-                                 .filter_by(request_id=self.id)
-        for job in parametric_jobs.all():
-            job.delete_dirac_jobs(session)
-        parametric_jobs.delete(synchronize_session=False)
-
-
-    def update_status(self):
-        """Update request status."""
+                if not job.reset(chunk_size=chunk_size):
+                    incomplete.append(job.id)
+        else:
+            job_pool = ThreadPool(min(concurrency, len(parametricjobs)) or 1)
+            chunk_pool = ThreadPool(concurrency)
+            try:
+                results = [(job, job_pool.apply_async(job.reset, kwds={'pool': chunk_pool,
+                                                                       'chunk_size': chunk_size}))
+                           for job in parametricjobs]
+                for job, result in results:
+                    try:
+                        if not result.get():
+                            incomplete.append(job.id)
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception("Exception while resetting ParametricJob %s of request %s",
+                                         job.id, self.id)
+                        incomplete.append(job.id)
+            finally:
+                job_pool.terminate()
+                chunk_pool.terminate()
+
+        if incomplete:
+            logger.error("ParametricJobs %s of request %s were not fully reset",
+                         incomplete, self.id)
+            return False
+        logger.info("Reset request %s in %.1fs", self.id, time.time() - start)
+        return True
+
+    @staticmethod
+    def delete_requests(request_ids, concurrency=DELETE_THREADS, chunk_size=DIRAC_CHUNK_SIZE):
+        """
+        Delete requests along with their ParametricJobs, DIRAC jobs and progress summaries.
+
+        The DIRAC jobs are first killed and deleted on DIRAC, in chunks sent
+        concurrently, and only those DIRAC confirmed deleted are removed from
+        the DB. Requests left with DIRAC jobs are kept so that deleting them
+        again only retries the remaining jobs. The fully removed requests are
+        deleted with one set based DELETE per table.
+
+        Args:
+            request_ids (list): The ids of the requests to delete
+            concurrency (int): [Optional] The maximum number of chunks to send concurrently
+            chunk_size (int): [Optional] The maximum number of DIRAC job ids per RPC call
+
+        Returns:
+            list: The ids of the requests that still have DIRAC jobs
+        """
+        with db_session() as session:
+            dirac_jobs = session.query(DiracJobs.id, DiracJobs.parametricjob_id, ParametricJobs.request_id)\
+                                .join(DiracJobs.parametricjob)\
+                                .filter(ParametricJobs.request_id.in_(request_ids))\
+                                .all()
+
+        confirmed = set()
+        if dirac_jobs:
+            pool = ThreadPool(concurrency)
+            try:
+                confirmed = DiracJobs.kill_and_delete([job.id for job in dirac_jobs], chunk_size, pool)
+            finally:
+                pool.terminate()
+
+        incomplete = set(job.request_id for job in dirac_jobs if job.id not in confirmed)
+        complete = [request_id for request_id in request_ids if request_id not in incomplete]
+        confirmed_jobs = defaultdict(list)
+        for job in dirac_jobs:
+            if job.request_id in incomplete and job.id in confirmed:
+                confirmed_jobs[job.parametricjob_id].append(job.id)
+
+        with db_session() as session:
+            for parametricjob_id, dirac_job_ids in confirmed_jobs.iteritems():
+                DiracJobs.delete_jobs(parametricjob_id, dirac_job_ids, session)
+            if complete:
+                parametricjob_ids = select([ParametricJobs.id]).where(ParametricJobs.request_id.in_(complete))
+                session.query(DiracJobs)\
+                       .filter(DiracJobs.parametricjob_id.in_(parametricjob_ids))\
+                       .delete(synchronize_session=False)
+                session.query(ProgressSummaries)\
+                       .filter(ProgressSummaries.request_id.in_(complete))\
+                       .delete(synchronize_session=False)
+                session.query(ParametricJobs)\
+                       .filter(ParametricJobs.request_id.in_(complete))\
+                       .delete(synchronize_session=False)
+                session.query(Requests)\
+                       .filter(Requests.id.in_(complete))\
+                       .delete(synchronize_session=False)
+        return sorted(incomplete)
+
+    def update_status(self, dirac_statuses=None, pool=None, timeout=None):
+        """
+        Update request status.
+
+        ParametricJobs whose DIRAC jobs could not be refreshed have their
+        status set from the current counts of their DIRAC jobs instead.
+
+        Args:
+            dirac_statuses (dict): [Optional] DIRAC status answers already collected
+                                   for this monitoring cycle.
+            pool (multiprocessing.pool.ThreadPool): [Optional] Worker pool used to
+                                                    update the ParametricJobs concurrently.
+            timeout (float): [Optional] Time in seconds to wait for each ParametricJob
+                             update when using a pool.
+        """
         with db_session() as session:
             parametricjobs = session.query(ParametricJobs).filter_by(request_id=self.id).all()
             session.expunge_all()
 
+        # Refresh the DIRAC jobs of each ParametricJob.
+        updated_jobs = []
+        if pool is None:
+            for job in parametricjobs:
+                try:
+                    updated_jobs.append((job, DiracJobs.update_status(job, dirac_statuses)))
+                except:
+                    logger.exception("Exception updating ParametricJob %s", job.id)
+        else:
+            results = [(job, pool.apply_async(DiracJobs.update_status,
+                                              (job, dirac_statuses)))
+                       for job in parametricjobs]
+            for job, result in results:
+                try:
+                    updated_jobs.append((job, result.get(timeout)))
+                except TimeoutError:
+                    logger.error("Timed out updating ParametricJob %s", job.id)
+                except:
+                    logger.exception("Exception updating ParametricJob %s", job.id)
+
+        # Jobs whose refresh failed still get their status from the current
+        # counts, rolled up for the whole request in a single GROUP BY.
+        updated_ids = set(job.id for job, _ in updated_jobs)
+        failed_jobs = [job for job in parametricjobs if job.id not in updated_ids]
+        if failed_jobs:
+            try:
+                counts = DiracJobs.request_status_counts(self.id)
+            except:
+                logger.exception("Exception counting the DIRAC jobs of request %s", self.id)
+            else:
+                updated_jobs.extend((job, counts.get(job.id, Counter())) for job in failed_jobs)
+
         statuses = []
-        for job in parametricjobs:
+        for job, job_statuses in updated_jobs:
             try:
-                statuses.append(job.update_status())
+                statuses.append(job.set_status(job_statuses))
             except:
                 logger.exception("Exception updating ParametricJob %s", job.id)
 
@@ -87,47 +288,125 @@ class Requests(SQLTableBase):
 
 
     @staticmethod
-    def GET(reqid=None):  # pylint: disable=invalid-name
-        """REST Get method."""
+    def GET(reqid=None, **kwargs):  # pylint: disable=invalid-name
+        """
+        REST Get method.
+
+        If called with DataTables server-side processing parameters then
+        only the requested page of requests is returned. Answers
+        If-None-Match with 304 Not Modified if the requests are unchanged.
+        """
         logger.debug("In GET: reqid = %s", reqid)
         requester = cherrypy.request.verified_user
         with db_session() as session:
-            user_requests = session.query(Requests).filter_by(requester_id=requester.id)
+            version = session.query(func.count(Requests.id), func.max(Requests.timestamp))
+            if not requester.admin:
+                version = version.filter(Requests.requester_id == requester.id)
+            if reqid is not None:
+                version = version.filter(Requests.id == reqid)
+            version = version.one()
+            # Admins also see the requester names.
+            users_version = session.query(func.count(Users.id), func.max(Users.timestamp)).one()\
+                if requester.admin else None
+        etag = resource_etag(version, requester.id, requester.admin, reqid,
+                             sorted(kwargs.iteritems()), users_version)
+        return conditional_response(etag, lambda: Requests._get(requester, reqid, kwargs))
+
+    @staticmethod
+    def _get(requester, reqid, kwargs):
+        """Render the REST Get response."""
+        serializer = RowSerializer(Requests)
+        with db_session() as session:
+            user_requests = session.query(*serializer.attributes).filter_by(requester_id=requester.id)
             # Get all requests.
             if reqid is None:
+                names = {}
                 if requester.admin:
-                    all_requests = session.query(Requests, Users)\
-                                          .join(Users, Requests.requester_id == Users.id)\
-                                          .all()
-                    # could make a specialised encoder for this.
-                    return json.dumps({'data': [dict(request, requester=user.name, status=request.status.name)
-                                                for request, user in all_requests]},
-                                      cls=JSONTableEncoder)
-                return json.dumps({'data': user_requests.all()}, cls=JSONTableEncoder)
+                    # Only the requesters' names are needed so work them out once per user.
+                    names = {user_id: Users.name_from_dn(dn)
+                             for user_id, dn in session.query(Users.id, Users.dn).all()}
+                    serializer = RowSerializer(Requests,
+                                               requester=lambda row: names[row.requester_id])
+                    user_requests = session.query(*serializer.attributes)
+                if datatables.is_server_side(kwargs):
+                    return Requests._datatables_response(serializer, user_requests,
+                                                         datatables.parse_request(kwargs), names)
+                return serializer.dumps(user_requests.all())
 
             # Get specific request.
             if requester.admin:
-                user_requests = session.query(Requests)
+                user_requests = session.query(*serializer.attributes)
             request = user_requests.filter_by(id=reqid).first()
-            return json.dumps({'data': request}, cls=JSONTableEncoder)
+            return json.dumps({'data': serializer.row(request)})
+
+    @staticmethod
+    def _datatables_response(serializer, query, params, names):
+        """
+        Answer a DataTables server-side request for the request listing.
 
+        Args:
+            serializer (RowSerializer): Serializer for the request rows
+            query (sqlalchemy.orm.Query): The query of all requests visible to the user
+            params (datatables.DataTablesRequest): The parsed request
+            names (dict): Requester names keyed by user id, empty if not shown
+
+        Returns:
+            str: The JSON response, including the status counts of all visible
+                 requests for the summary chart
+        """
+        def search(term):
+            """Clauses matching the search term."""
+            clauses = datatables.text_search(term, Requests.id, Requests.description,
+                                             Requests.sim_lead, Requests.request_date)
+            clauses.extend(datatables.enum_search(term, Requests.status, LOCALSTATUS))
+            requester_ids = [user_id for user_id, name in names.iteritems()
+                             if term.lower() in name.lower()]
+            if requester_ids:
+                clauses.append(Requests.requester_id.in_(requester_ids))
+            return clauses
+
+        order = {'id': Requests.id,
+                 'description': Requests.description,
+                 'sim_lead': Requests.sim_lead,
+                 'status': datatables.rank(Requests.status, STATUS_ORDER),
+                 'request_date': Requests.request_date,
+                 'requester': datatables.rank(Requests.requester_id,
+                                              {user_id: i for i, (user_id, _) in
+                                               enumerate(sorted(names.iteritems(),
+                                                                key=lambda item: item[1]))})}
+        status_counts = query.with_entities(Requests.status, func.count(Requests.id))\
+                             .group_by(Requests.status)\
+                             .all()
+        return datatables.server_side_response(serializer, query, params, search, order,
+                                               statusCounts={status.name: num
+                                                             for status, num in status_counts})
 
     @staticmethod
     def DELETE(reqid):  # pylint: disable=invalid-name
-        """REST Delete method."""
+        """
+        REST Delete method.
+
+        The DIRAC jobs of the requests are killed and deleted from DIRAC
+        before the requests are deleted. Requests whose DIRAC jobs could not
+        all be removed are kept and reported with a 500 error, deleting them
+        again retries the remaining jobs.
+
+        Args:
+            reqid (str): The request id or a comma separated list of ids
+        """
         logger.debug("In DELETE: reqid = %s", reqid)
         if cherrypy.request.verified_user.admin:
-            with db_session() as session:
-                logger.info("Deleting Request id: %s", reqid)
-                try:
-                    request = session.query(Requests).filter_by(id=reqid).one()
-                except NoResultFound:
-                    logger.warning("No Request found with id: %s", reqid)
-                except MultipleResultsFound:
-                    logger.error("Multiple Requests found with id: %s!", reqid)
-                else:
-                    request.delete_parametric_jobs(session)
-                    session.delete(request)
+            try:
+                request_ids = [int(request_id) for request_id in reqid.split(',')]
+            except ValueError:
+                raise cherrypy.HTTPError(400, 'Bad Request: Invalid request id(s): %s' % reqid)
+            logger.info("Deleting Request ids: %s", request_ids)
+            incomplete = Requests.delete_requests(request_ids)
+            if incomplete:
+                logger.error("Failed to remove all DIRAC jobs of Requests %s", incomplete)
+                raise cherrypy.HTTPError(500, 'Failed to remove all DIRAC jobs of request(s) %s, '
+                                              'delete again to retry'
+                                         % ', '.join(str(request_id) for request_id in incomplete))
         return Requests.GET()
 
     @staticmethod
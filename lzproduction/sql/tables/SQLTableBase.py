@@ -21,12 +21,25 @@ class DeclarativeABCMeta(DeclarativeMeta, ABCMeta):
 
 
 class ColumnsDescriptor(object):
-    """Yield the column names."""
+    """
+    The column names.
+
+    The names are computed once per table class and cached
+    in the given container type.
+    """
+
+    def __init__(self, container=tuple):
+        """Initialise."""
+        self._container = container
+        self._cache = {}
 
     def __get__(self, obj, cls):
         """Descriptor get."""
-        for column in cls.__table__.columns:
-            yield column.name
+        try:
+            return self._cache[cls]
+        except KeyError:
+            names = self._cache[cls] = self._container(column.name for column in cls.__table__.columns)
+            return names
 
     def __set__(self, obj, value):
         """Descriptor set."""
@@ -45,19 +58,20 @@ class IterableBase(Mapping):
     # This we can get from the class as well as instance
     # unlike property
     columns = ColumnsDescriptor()
+    _column_set = ColumnsDescriptor(frozenset)
 
     def __iter__(self):
         """Get an iterator over instrumented attributes."""
-        return self.columns
+        return iter(self.columns)
 
     def __getitem__(self, item):
         """Access instrumented attributes as a dict."""
-        if item not in self.columns:
+        if item not in self._column_set:
             raise KeyError("Invalid attribute name: %s" % item)
         return getattr(self, item)
 
     def __len__(self):
-        return len(list(self.columns))
+        return len(self.columns)
 
 SQLTableBase = declarative_base(cls=IterableBase,  # pylint: disable=invalid-name
                                 metaclass=DeclarativeABCMeta)
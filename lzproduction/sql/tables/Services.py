@@ -10,6 +10,6 @@ class Services(SQLTableBase):
 
     __tablename__ = 'services'
     id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
-    name = Column(String(25), nullable=False)
+    name = Column(String(25), nullable=False, index=True)
     status = Column(Enum(SERVICESTATUS), nullable=False)
     timestamp = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,5 +1,6 @@
 """Users Table."""
-from sqlalchemy import Column, Integer, String, Boolean
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, Index
 from .SQLTableBase import SQLTableBase
 
 
@@ -7,28 +8,43 @@ class Users(SQLTableBase):
     """Users SQL Table."""
 
     __tablename__ = 'users'
+    __table_args__ = (Index('ix_users_dn_ca', 'dn', 'ca'),)
     id = Column(Integer, primary_key=True)  # pylint: disable=invalid-name
     dn = Column(String(250), nullable=False)  # pylint: disable=invalid-name
     ca = Column(String(250), nullable=False)  # pylint: disable=invalid-name
     email = Column(String(250), nullable=False)
     suspended = Column(Boolean, nullable=False)
     admin = Column(Boolean, nullable=False)
+    timestamp = Column(TIMESTAMP, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     @property
     def name(self):
         """
         Human-readable name from DN.
 
+        Returns:
+            str: The human-readable name
+        """
+        return self.name_from_dn(self.dn)
+
+    @staticmethod
+    def name_from_dn(dn):  # pylint: disable=invalid-name
+        """
+        Human-readable name from DN.
+
         Attempt to determine a meaningful name from a
         clients DN. Requires the DN to have already been
         converted to the more usual slash delimeted style.
         If multiple CN fields exist in the DN then the longest
         is assumend to be the desired human readable field.
 
+        Args:
+            dn (str): The client DN
+
         Returns:
             str: The human-readable name
         """
-        cns = (token[len('CN='):] for token in self.dn.split('/')
+        cns = (token[len('CN='):] for token in dn.split('/')
                if token.startswith('CN='))
         return sorted(cns, key=len)[-1]
 
@@ -3,18 +3,26 @@ Initialise module.
 
 Load all tables at module scope.
 """
-from sqlalchemy import create_engine
 from .SQLTableBase import SQLTableBase
 from .Users import Users
 from .Services import Services
 from .ParametricJobs import ParametricJobs
 from .Requests import Requests
 from .DiracJobs import DiracJobs
-from ..utils import rebind_session
+from .Cursors import Cursors
+from .ProgressSummaries import ProgressSummaries
+from ..utils import get_engine, rebind_session
+from ..migrate import upgrade_schema
 
-def create_all_tables(url):
-    """Create all tables of type Base."""
-    engine = create_engine(url)
+def create_all_tables(url, **engine_options):
+    """
+    Create all tables of type Base, upgrading the schema of any existing ones.
+
+    Also binds the session to the shared engine of the url, created with
+    the given engine_options if this is its first use (see get_engine).
+    """
+    engine = get_engine(url, **engine_options)
     SQLTableBase.metadata.create_all(bind=engine)
+    upgrade_schema(engine, SQLTableBase.metadata)
     rebind_session(engine)
 
@@ -4,15 +4,177 @@ SQLAlchemy utility module.
 Contains helper classes and functions for working
 with SQLAlchemy.
 """
+import time
 import logging
+import threading
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, scoped_session
 
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+if not hasattr(logging, 'statistics'):
+    logging.statistics = {}
+
 SESSION = scoped_session(sessionmaker())
+ENGINES = {}
+ENGINES_LOCK = threading.Lock()
+POOL_DEFAULTS = {'pool_size': 10,
+                 'max_overflow': 20,
+                 'pool_timeout': 30,
+                 'pool_recycle': 3600}
+SQLITE_BUSY_TIMEOUT = 30  # secs
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording the time spent waiting for connections."""
+
+    stats = None
+
+    def _do_get(self):
+        """Get a connection from the pool, timing the wait."""
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats['Timeouts'] += 1
+            raise
+        finally:
+            if self.stats is not None:
+                wait = time.time() - start
+                self.stats['Wait Time'] += wait
+                self.stats['Max Wait Time'] = max(self.stats['Max Wait Time'], wait)
+
+    def recreate(self):
+        """Recreate the pool, keeping the stats."""
+        pool = super(TimedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _is_sqlite_memory(url):
+    """Return whether url is an in memory SQLite DB."""
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """Configure new SQLite connections for concurrent use."""
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers carry on while a writer is committing.
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=%i' % (SQLITE_BUSY_TIMEOUT * 1000))
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def _ping_connection(connection, branch):
+    """
+    Test connections as they are checked out of the pool.
+
+    Connections that turn out to be stale, e.g. closed by the DB server
+    while idle, are invalidated and transparently replaced.
+    """
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as err:
+        if not err.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
+
+
+def _track_pool(engine):
+    """Publish the pool checkout and wait statistics of an engine."""
+    stats = logging.statistics.setdefault('LZProduction DB Pool %r' % engine.url,
+                                          {'Connects': 0,
+                                           'Checkouts': 0,
+                                           'Checked Out': 0,
+                                           'Max Checked Out': 0,
+                                           'Invalidations': 0,
+                                           'Timeouts': 0,
+                                           'Wait Time': 0.,
+                                           'Max Wait Time': 0.,
+                                           'Status': lambda s: engine.pool.status()})
+
+    def on_connect(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        """Count new connections."""
+        stats['Connects'] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-argument
+        """Count checkouts."""
+        stats['Checkouts'] += 1
+        stats['Checked Out'] += 1
+        stats['Max Checked Out'] = max(stats['Max Checked Out'], stats['Checked Out'])
+
+    def on_checkin(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        """Count checkins."""
+        stats['Checked Out'] -= 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):  # pylint: disable=unused-argument
+        """Count invalidated connections."""
+        stats['Invalidations'] += 1
+
+    event.listen(engine, 'connect', on_connect)
+    event.listen(engine, 'checkout', on_checkout)
+    event.listen(engine, 'checkin', on_checkin)
+    event.listen(engine, 'invalidate', on_invalidate)
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.stats = stats
+    return stats
+
+
+def get_engine(url, pre_ping=True, **kwargs):
+    """
+    Get the shared engine for a DB url.
+
+    Each engine, and so its connection pool, is created once per url
+    on first use. Later calls return the same engine and ignore the
+    options. SQLite file DBs are configured for concurrent use with WAL
+    journalling, a busy timeout and synchronous=NORMAL.
+
+    Args:
+        url (str): The DB url
+        pre_ping (bool): Test connections as they are checked out of the pool
+        kwargs (dict): Pool options overriding POOL_DEFAULTS, e.g. pool_size,
+                       max_overflow, pool_timeout and pool_recycle
+
+    Returns:
+        sqlalchemy.engine.Engine: The engine
+    """
+    url = make_url(url)
+    key = str(url)
+    with ENGINES_LOCK:
+        engine = ENGINES.get(key)
+        if engine is not None:
+            return engine
+
+        if _is_sqlite_memory(url):
+            # Each connection would be a different DB so keep the default pool.
+            engine = create_engine(url)
+        else:
+            options = dict(POOL_DEFAULTS, poolclass=TimedQueuePool)
+            options.update((name, value) for name, value in kwargs.iteritems() if value is not None)
+            if url.get_backend_name() == 'sqlite':
+                options['connect_args'] = {'check_same_thread': False,
+                                           'timeout': SQLITE_BUSY_TIMEOUT}
+            engine = create_engine(url, **options)
+            if url.get_backend_name() == 'sqlite':
+                event.listen(engine, 'connect', _set_sqlite_pragmas)
+            elif pre_ping:
+                event.listen(engine, 'engine_connect', _ping_connection)
+        _track_pool(engine)
+        ENGINES[key] = engine
+        logger.info("Created DB engine for %r", url)
+        return engine
 
 
 def rebind_session(engine):
@@ -24,7 +186,9 @@ def rebind_session(engine):
 def db_session(url=None, reraise=True):
     """Provide a transactional scope around a series of operations."""
     if url is not None:
-        rebind_session(create_engine(url))
+        engine = get_engine(url)
+        if SESSION.session_factory.kw.get('bind') is not engine:
+            rebind_session(engine)
 
     try:
         yield SESSION()
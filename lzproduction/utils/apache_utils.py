@@ -5,11 +5,18 @@ Tools for dealing with credential checking from X509 SSL certificates.
 These are useful when using Apache as a reverse proxy to check user
 credentials against a local DB.
 """
+import time
+import logging
+import threading
 import cherrypy
+from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from lzproduction.sql.utils import db_session
 from lzproduction.sql.tables import Users
 
+if not hasattr(logging, 'statistics'):
+    logging.statistics = {}
+
 
 def apache_client_convert(client_dn, client_ca=None):
     """
@@ -32,6 +39,94 @@ def apache_client_convert(client_dn, client_ca=None):
     return client_dn, client_ca
 
 
+class VerifiedUserCache(object):
+    """
+    Thread-safe TTL cache of verified users.
+
+    Users are keyed by their converted (DN, CA). As the users table is also
+    modified by other processes (userdb-update.py) the cache is cleared
+    whenever the table generation, its row count and latest modification
+    time, changes. This is checked at most every check_interval seconds so
+    lookups are otherwise only a dictionary access. Hit and miss counts are
+    published to the CherryPy statistics.
+    """
+
+    def __init__(self, ttl=300, check_interval=10):
+        """
+        Initialise.
+
+        Args:
+            ttl (float): Time a verified user is cached for (in secs)
+            check_interval (float): Time between checks of the users table
+                                    generation (in secs)
+        """
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._users = {}
+        self._lock = threading.Lock()
+        self._generation = None
+        self._next_check = 0
+        self.stats = logging.statistics.setdefault('LZProduction Verified Users',
+                                                   {'Hits': 0, 'Misses': 0, 'Invalidations': 0})
+
+    @staticmethod
+    def _table_generation():
+        """Return the current users table generation."""
+        with db_session() as session:
+            return session.query(func.count(Users.id), func.max(Users.timestamp)).one()
+
+    def _check_generation(self):
+        """Clear the cache if the users table has changed."""
+        now = time.time()
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+        generation = tuple(self._table_generation())
+        if generation != self._generation:
+            self.invalidate()
+            self._generation = generation
+
+    def get(self, client_dn, client_ca):
+        """
+        Get a cached user.
+
+        Args:
+            client_dn (str): The converted client DN
+            client_ca (str): The converted client CA
+
+        Returns:
+            Users: The cached user or None
+        """
+        self._check_generation()
+        with self._lock:
+            user, expires = self._users.get((client_dn, client_ca), (None, 0))
+            if user is not None and expires > time.time():
+                self.stats['Hits'] += 1
+                return user
+            self.stats['Misses'] += 1
+        return None
+
+    def add(self, user):
+        """
+        Add a verified user to the cache.
+
+        Args:
+            user (Users): The detached user
+        """
+        with self._lock:
+            self._users[(user.dn, user.ca)] = (user, time.time() + self.ttl)
+
+    def invalidate(self):
+        """Clear the cache."""
+        with self._lock:
+            self._users.clear()
+            self.stats['Invalidations'] += 1
+
+
+USER_CACHE = VerifiedUserCache()
+
+
 class CredentialDispatcher(object):
     """
     Dispatcher that checks SSL credentials.
@@ -60,29 +155,33 @@ class CredentialDispatcher(object):
             raise cherrypy.HTTPError(401, 'Unauthorized: Cert not verified for user DN: %s, CA: %s.'
                                      % (client_dn, client_ca))
 
-        with db_session() as session:
-            try:
-                user = session.query(Users)\
-                              .filter_by(dn=client_dn, ca=client_ca)\
-                              .one()
-            except MultipleResultsFound:
-                raise cherrypy.HTTPError(500, 'Internal Server Error: Duplicate user detected. '
-                                              'user: (%s, %s)'
-                                         % (client_dn, client_ca))
-            except NoResultFound:
-                raise cherrypy.HTTPError(403, 'Forbidden: Unknown user. user: (%s, %s)'
-                                         % (client_dn, client_ca))
-            if user.suspended:
-                raise cherrypy.HTTPError(403, 'Forbidden: User is suspended by VO. user: (%s, %s)'
-                                         % (client_dn, client_ca))
-
-            if self._admin_only and not user.admin:
-                raise cherrypy.HTTPError(403, 'Forbidden: Admin users only')
-
-            session.expunge(user)
-            cherrypy.request.verified_user = user
+        user = USER_CACHE.get(client_dn, client_ca)
+        if user is None:
+            with db_session() as session:
+                try:
+                    user = session.query(Users)\
+                                  .filter_by(dn=client_dn, ca=client_ca)\
+                                  .one()
+                except MultipleResultsFound:
+                    raise cherrypy.HTTPError(500, 'Internal Server Error: Duplicate user detected. '
+                                                  'user: (%s, %s)'
+                                             % (client_dn, client_ca))
+                except NoResultFound:
+                    raise cherrypy.HTTPError(403, 'Forbidden: Unknown user. user: (%s, %s)'
+                                             % (client_dn, client_ca))
+                session.expunge(user)
+            USER_CACHE.add(user)
+
+        if user.suspended:
+            raise cherrypy.HTTPError(403, 'Forbidden: User is suspended by VO. user: (%s, %s)'
+                                     % (client_dn, client_ca))
+
+        if self._admin_only and not user.admin:
+            raise cherrypy.HTTPError(403, 'Forbidden: Admin users only')
+
+        cherrypy.request.verified_user = user
 
         return self._dispatcher(path)
 
 
-__all__ = ('apache_client_convert', 'CredentialDispatcher')
+__all__ = ('apache_client_convert', 'VerifiedUserCache', 'USER_CACHE', 'CredentialDispatcher')
@@ -0,0 +1,76 @@
+"""Utilities for reading from git repositories without checking out."""
+import time
+import logging
+import threading
+import pylru
+from git import Git, Repo, GitCommandError
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+FETCH_INTERVAL = 60
+FETCH_LOCK = threading.Lock()
+LAST_FETCH = {}
+READ_LOCK = threading.Lock()
+FILE_CACHE = pylru.lrucache(512)
+
+
+def fetch(git_dir, remote='origin', min_interval=FETCH_INTERVAL):
+    """
+    Rate limited fetch from a remote.
+
+    Only one fetch per repository is run at a time and not more often than
+    min_interval. Callers that arrive while a fetch is in progress wait for
+    it to finish and then share its result rather than fetching again.
+
+    Args:
+        git_dir (str): Path to the git repository
+        remote (str): The remote to fetch from
+        min_interval (float): Minimum time between fetches (in secs)
+
+    Returns:
+        bool: Whether this call performed a fetch
+    """
+    with FETCH_LOCK:
+        if time.time() - LAST_FETCH.get(git_dir, 0) < min_interval:
+            return False
+        start = time.time()
+        try:
+            Git(git_dir).fetch(remote)
+        finally:
+            LAST_FETCH[git_dir] = time.time()
+        logger.info("Fetched %s from %s in %.1fs", git_dir, remote, time.time() - start)
+        return True
+
+
+def read_file(git_dir, ref, path):
+    """
+    Read a file from a git ref without checking it out.
+
+    The equivalent of `git show ref:path`. Results are kept in an LRU cache
+    keyed by (ref, path) as refs are expected to be immutable tags. On a cache
+    miss a rate limited fetch is made first so that new tags can be found.
+
+    Args:
+        git_dir (str): Path to the git repository
+        ref (str): The tag (or other ref) to read from
+        path (str): Path of the file relative to the repository root
+
+    Returns:
+        str: The file content
+
+    Raises:
+        KeyError: If the path does not exist in ref
+    """
+    key = (git_dir, ref, path)
+    with READ_LOCK:
+        if key in FILE_CACHE:
+            return FILE_CACHE[key]
+
+    try:
+        fetch(git_dir)
+    except GitCommandError:
+        logger.exception("Failed to fetch %s, using local objects.", git_dir)
+
+    with READ_LOCK:
+        content = (Repo(git_dir).commit(ref).tree / path).data_stream.read()
+        FILE_CACHE[key] = content
+    return content
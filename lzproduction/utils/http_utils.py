@@ -0,0 +1,104 @@
+"""
+HTTP Utils.
+
+Tools for answering conditional GET requests with ETags and caching
+the compressed response bodies.
+"""
+import gzip
+import hashlib
+import logging
+import threading
+import cStringIO
+from datetime import datetime, timedelta
+import cherrypy
+import pylru
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+# Rows modified more recently than this might still change within the
+# resolution of the DB timestamps so their versions are not trusted.
+SETTLE_TIME = timedelta(seconds=2)
+GZIP_CACHE = pylru.lrucache(256)
+GZIP_CACHE_LOCK = threading.Lock()
+
+
+def resource_etag(version, *keys):
+    """
+    Build an ETag for a resource.
+
+    Args:
+        version (tuple): The resource version as the (row count, latest row
+                         timestamp) of the underlying table rows
+        keys (list): Anything else the response depends on, e.g. the user
+                     and query parameters
+
+    Returns:
+        str: The quoted ETag or None if the resource has changed too
+             recently for its version to be relied on
+    """
+    count, latest = version
+    if latest is not None and datetime.utcnow() - latest < SETTLE_TIME:
+        return None
+    return '"%s"' % hashlib.sha1(repr((count, latest) + keys)).hexdigest()
+
+
+def _accepts_gzip():
+    """Return whether the client accepts a gzip encoded response."""
+    for coding in cherrypy.request.headers.elements('Accept-Encoding'):
+        if coding.value in ('gzip', 'x-gzip'):
+            return coding.qvalue != 0
+    return False
+
+
+def _gzip(body, compress_level=5):
+    """Gzip a response body."""
+    buf = cStringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=compress_level) as gzip_file:
+        gzip_file.write(body)
+    return buf.getvalue()
+
+
+def conditional_response(etag, render):
+    """
+    Answer a conditional GET.
+
+    If the client already holds the current version of the resource a
+    304 Not Modified is raised without rendering the body. Otherwise the
+    body is rendered and, if the client accepts it, served gzipped from
+    a cache keyed by ETag so that it is only compressed once per version.
+
+    Args:
+        etag (str): The resource ETag or None to always render
+        render (function): Function returning the response body
+
+    Returns:
+        str: The response body
+    """
+    response = cherrypy.response
+    if etag is None:
+        return render()
+
+    use_gzip = _accepts_gzip()
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Differently encoded bodies must have different strong ETags.
+    response_etag = etag[:-1] + '-gzip"' if use_gzip else etag
+    response.headers['ETag'] = response_etag
+    conditions = [str(condition) for condition in cherrypy.request.headers.elements('If-None-Match')]
+    if response_etag in conditions or '*' in conditions:
+        raise cherrypy.HTTPRedirect([], 304)
+
+    if not use_gzip:
+        return render()
+
+    with GZIP_CACHE_LOCK:
+        body = GZIP_CACHE[etag] if etag in GZIP_CACHE else None
+    if body is None:
+        body = _gzip(render())
+        with GZIP_CACHE_LOCK:
+            GZIP_CACHE[etag] = body
+    response.headers['Content-Encoding'] = 'gzip'
+    # Stop the gzip tool compressing the body again.
+    cherrypy.request.cached = True
+    return body
+
+
+__all__ = ('resource_etag', 'conditional_response')
@@ -1,29 +1,94 @@
 """Functions for creating temporary job file."""
+from __future__ import absolute_import
 import os
+import shutil
+import hashlib
+import tempfile
+import threading
 import pkg_resources
 from textwrap import dedent
 from string import Template
+from collections import Counter
 from contextlib import contextmanager
 import jinja2
-from git import Git
+from .git_utils import read_file
+
+SANDBOX_DIR = os.path.join(tempfile.gettempdir(), 'lzprod_sandbox')
+SANDBOX_LOCK = threading.Lock()
+SANDBOX_REFS = Counter()
+TEMPLATE_ENV = None
+TEMPLATE_ENV_LOCK = threading.Lock()
+
+
+def runscript_template_env():
+    """
+    Get the shared runscript template environment.
+
+    The environment is created once per process. It keeps the compiled
+    templates in memory and their bytecode in a cache on disk so that
+    the templates are neither reloaded nor recompiled for each submission.
+
+    Returns:
+        jinja2.Environment: The runscript template environment
+    """
+    global TEMPLATE_ENV  # pylint: disable=global-statement
+    with TEMPLATE_ENV_LOCK:
+        if TEMPLATE_ENV is None:
+            templates_dir = pkg_resources.resource_filename('lzproduction', 'resources/bash')
+            template_env = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=templates_dir),
+                                              bytecode_cache=jinja2.FileSystemBytecodeCache(),
+                                              trim_blocks=True,
+                                              lstrip_blocks=True)
+            template_env.filters['filename'] = lambda path: os.path.splitext(os.path.basename(path))[0]
+            TEMPLATE_ENV = template_env
+        return TEMPLATE_ENV
 
 
 @contextmanager
-def temporary_runscript(**kwargs):
-    """Create temporary runscript."""
-#    pkg_resources.resource_filename(__name__, 'runscript_templates')
-    templates_dir = pkg_resources.resource_filename('lzproduction', 'resources/bash')
-#    templates_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'bash')
-    template_env = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=templates_dir),
-                                      trim_blocks=True,
-                                      lstrip_blocks=True)
-    template_env.filters['filename'] = lambda path: os.path.splitext(os.path.basename(path))[0]
-    with open('/tmp/runscript.sh', 'wb') as runscript:
-        runscript.write(template_env.get_template('runscript_template.bash').render(**kwargs))
+def sandbox_file(name, content):
+    """
+    Create a content-addressed temporary file.
+
+    Files are stored under a directory named by the hash of their name
+    and content, so callers with identical inputs share the same file
+    while different inputs never clash. The file is removed once the
+    last user exits the context.
+
+    Args:
+        name (str): The file name
+        content (str): The file content
+
+    Returns:
+        str: The path to the file
+    """
+    digest = hashlib.sha1(name + '\0' + content).hexdigest()
+    file_dir = os.path.join(SANDBOX_DIR, digest)
+    path = os.path.join(file_dir, name)
+    with SANDBOX_LOCK:
+        if not SANDBOX_REFS[path] and not os.path.isfile(path):
+            if not os.path.isdir(file_dir):
+                os.makedirs(file_dir, 0o700)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=file_dir)
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                tmp_file.write(content)
+            os.rename(tmp_path, path)
+        SANDBOX_REFS[path] += 1
     try:
-        yield runscript.name
+        yield path
     finally:
-        os.remove(runscript.name)
+        with SANDBOX_LOCK:
+            SANDBOX_REFS[path] -= 1
+            if not SANDBOX_REFS[path]:
+                del SANDBOX_REFS[path]
+                shutil.rmtree(file_dir, ignore_errors=True)
+
+
+@contextmanager
+def temporary_runscript(**kwargs):
+    """Create temporary runscript."""
+    runscript = runscript_template_env().get_template('runscript_template.bash').render(**kwargs)
+    with sandbox_file('runscript.sh', runscript.encode('utf-8')) as runscript_path:
+        yield runscript_path
 
 
 @contextmanager
@@ -45,18 +110,11 @@ def temporary_macro(tag, macro, app, app_version, nevents):
             """))
     lzprod_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
     git_dir = os.path.join(lzprod_root, 'git', 'TDRAnalysis')
-    macro = os.path.join(git_dir, macro)
-    git = Git(git_dir)
-    git.fetch('origin')
-    git.checkout(tag)
-    if not os.path.isfile(macro):
+    try:
+        macro_contents = read_file(git_dir, tag, macro)
+    except KeyError:
         raise Exception("Macro file '%s' doesn't exist in tag %s" % (macro, tag))
 
-    with open(os.path.join('/tmp', os.path.basename(macro)), 'wb') as tmp_macro, \
-         open(macro, 'rb') as macro_file:
-        tmp_macro.write(macro_file.read())
-        tmp_macro.write(macro_extras.safe_substitute(app=app_map.get(app, app), nevents=nevents))
-    try:
-        yield tmp_macro.name
-    finally:
-        os.remove(tmp_macro.name)
+    macro_contents += macro_extras.safe_substitute(app=app_map.get(app, app), nevents=nevents)
+    with sandbox_file(os.path.basename(macro), macro_contents) as macro_path:
+        yield macro_path
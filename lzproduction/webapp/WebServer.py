@@ -7,7 +7,7 @@ from daemonize import Daemonize
 import lzproduction.utils.jinja2_utils
 from lzproduction.utils.apache_utils import CredentialDispatcher
 from lzproduction.sql.tables import create_all_tables, Requests, ParametricJobs
-from .services import HTMLPageServer, CVMFSAppVersions, GitTagMacros, Admins#, RequestsDBAPI
+from .services import HTMLPageServer, CVMFSAppVersions, GitTagMacros, Admins, StatusEvents, StatusEventBroadcaster, ProgressSummary#, RequestsDBAPI
 
 
 class LZProductionServer(Daemonize):
@@ -21,6 +21,10 @@ class LZProductionServer(Daemonize):
                  thread_pool=8,
                  git_repo='git@lz-git.ua.edu:sim/TDRAnalysis.git',
                  git_dir=None,
+                 git_refresh_interval=5,
+                 max_event_clients=4,
+                 db_pool_size=None,
+                 db_max_overflow=None,
                  **kwargs):
         """Initialisation."""
         super(LZProductionServer, self).__init__(action=self.main, **kwargs)
@@ -31,10 +35,16 @@ class LZProductionServer(Daemonize):
         self._git_repo = git_repo
         self._src_root = os.path.join(production_root, 'src')
         self._git_dir = git_dir or os.path.join(production_root, 'git', 'TDRAnalysis')
+        self._git_refresh_interval = git_refresh_interval
+        self._max_event_clients = max_event_clients
+        self._db_pool_size = db_pool_size
+        self._db_max_overflow = db_max_overflow
 
     def main(self):
         """Daemon main."""
-        create_all_tables(self._dburl)
+        create_all_tables(self._dburl,
+                          pool_size=self._db_pool_size,
+                          max_overflow=self._db_max_overflow)
         resource_dir = pkg_resources.resource_filename('lzproduction', 'resources')
         html_resources =pkg_resources.resource_filename('lzproduction', 'resources/html')
         template_env = jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=resource_dir))
@@ -69,12 +79,21 @@ class LZProductionServer(Daemonize):
                                                       ['LUXSim', 'BACCARAT', 'TDRAnalysis', 'fastNEST', 'DER', 'LZap', 'Physics']),
                             '/appversion',
                             {'/': {'request.dispatch': CredentialDispatcher(cherrypy.dispatch.Dispatcher())}})
-        cherrypy.tree.mount(GitTagMacros(self._git_repo, self._git_dir, template_env),
+        cherrypy.tree.mount(GitTagMacros(self._git_repo, self._git_dir, template_env,
+                                         refresh_interval=self._git_refresh_interval),
                             '/tags',
                             {'/': {'request.dispatch': CredentialDispatcher(cherrypy.dispatch.Dispatcher())}})
         cherrypy.tree.mount(Admins(template_env),
                             '/admins',
                             {'/': {'request.dispatch': CredentialDispatcher(cherrypy.dispatch.MethodDispatcher(),
                                                                                           admin_only=True)}})
+        cherrypy.tree.mount(ProgressSummary(),
+                            '/summary',
+                            {'/': {'request.dispatch': CredentialDispatcher(cherrypy.dispatch.Dispatcher())}})
+        status_broadcaster = StatusEventBroadcaster(cherrypy.engine)
+        status_broadcaster.subscribe()
+        cherrypy.tree.mount(StatusEvents(status_broadcaster, max_clients=self._max_event_clients),
+                            '/events',
+                            {'/': {'request.dispatch': CredentialDispatcher(cherrypy.dispatch.Dispatcher())}})
         cherrypy.engine.start()
         cherrypy.engine.block()
@@ -1,5 +1,6 @@
 """Admin management service."""
 from lzproduction.sql.utils import db_session
+from lzproduction.utils.apache_utils import USER_CACHE
 from lzproduction.sql.tables import Users
 
 
@@ -50,3 +51,4 @@ class Admins(object):
         admin = (admin.lower() == 'true')
         with db_session() as session:
             session.query(Users).filter_by(id=int(user_id)).update({'admin': admin})
+        USER_CACHE.invalidate()
@@ -1,13 +1,17 @@
 """CVMFS Servcice."""
 import os
 import re
+import time
 import logging
+import threading
+from collections import namedtuple
 import cherrypy
 import html
 from natsort import natsorted
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 VERSION_RE = re.compile(r"^release-(\d{1,3}\.\d{1,3}\.\d{1,3})$")
+CacheEntry = namedtuple('CacheEntry', ('mtime', 'checked', 'html'))
 
 
 @cherrypy.popargs('appid')
@@ -17,29 +21,95 @@ class CVMFSAppVersions(object):
 
     CVMFS Service to get the list of versions available
     on CVMFS for a given app.
+
+    The rendered versions of each app are cached and revalidated against
+    the app directory mtime in a background thread, serving the stale
+    versions meanwhile, so requests don't block on a cold CVMFS mount.
+    All apps are loaded in parallel when the engine starts.
     """
 
-    def __init__(self, cvmfs_root, valid_apps):
-        """Initialise."""
+    def __init__(self, cvmfs_root, valid_apps, check_interval=60, cold_timeout=5):
+        """
+        Initialise.
+
+        Args:
+            cvmfs_root (str): The CVMFS repository root
+            valid_apps (list): The apps that can be queried
+            check_interval (float): Time after which a cached app is
+                                    revalidated (in secs)
+            cold_timeout (float): Maximum time to wait for an app not yet
+                                  cached to load (in secs)
+        """
         self.cvmfs_root = cvmfs_root
         self.valid_apps = valid_apps
+        self.check_interval = check_interval
+        self.cold_timeout = cold_timeout
+        self._cache = {}
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        cherrypy.engine.subscribe('start', self.prewarm)
+
+    def prewarm(self):
+        """Load the versions of all valid apps in parallel."""
+        for appid in self.valid_apps:
+            self._revalidate(appid)
+
+    def _revalidate(self, appid):
+        """
+        Start a background refresh of an app unless one is running.
+
+        Args:
+            appid (str): The app to refresh
+
+        Returns:
+            threading.Event: Set once the refresh completes
+        """
+        with self._lock:
+            done = self._refreshing.get(appid)
+            if done is None:
+                done = self._refreshing[appid] = threading.Event()
+                thread = threading.Thread(target=self._refresh, args=(appid, done),
+                                          name='CVMFSRefresh-%s' % appid)
+                thread.daemon = True
+                thread.start()
+            return done
+
+    def _refresh(self, appid, done):
+        """Reload the versions of an app if its directory changed."""
+        app_dir = os.path.join(self.cvmfs_root, appid)
+        try:
+            mtime = os.stat(app_dir).st_mtime
+            entry = self._cache.get(appid)
+            if entry is None or entry.mtime != mtime:
+                start = time.time()
+                _, dirs, _ = os.walk(app_dir).next()
+                html_ = html.HTML()
+                for dir_ in natsorted(dirs, reverse=True):
+                    for version in VERSION_RE.findall(dir_):
+                        html_.option(version)
+                entry = CacheEntry(mtime, time.time(), str(html_))
+                logger.info("Loaded CVMFS versions for %s in %.1fs", appid, time.time() - start)
+            self._cache[appid] = entry._replace(checked=time.time())
+        except (OSError, StopIteration):
+            logger.error("Couldn't access CVMFS dir: %s", app_dir)
+        finally:
+            with self._lock:
+                del self._refreshing[appid]
+            done.set()
 
     @cherrypy.expose
     def index(self, appid=None):
         """Return the index page."""
-        print "IN CVMFSAppVersion: appid=(%s)" % appid
         if appid not in self.valid_apps:
-            print "Invalid app type %s" % appid
+            logger.warning("Invalid app type %s", appid)
             return ''
-        html_ = html.HTML()
-        dirs = []
-        try:
-            _, dirs, _ = os.walk(os.path.join(self.cvmfs_root, appid)).next()
-        except StopIteration:
-            logger.error("Couldn't access CVMFS dir: %s",
-                         os.path.join(self.cvmfs_root, appid))
-
-        for dir_ in natsorted(dirs, reverse=True):
-            for version in VERSION_RE.findall(dir_):
-                html_.option(version)
-        return str(html_)
+
+        entry = self._cache.get(appid)
+        if entry is None:
+            self._revalidate(appid).wait(self.cold_timeout)
+            entry = self._cache.get(appid)
+            if entry is None:
+                return ''
+        elif time.time() - entry.checked > self.check_interval:
+            self._revalidate(appid)
+        return entry.html
@@ -1,18 +1,194 @@
 """Git tag service."""
 import os
+import json
+import random
+import logging
+import tempfile
 import threading
 from collections import namedtuple
 import cherrypy
-import pylru
+from cherrypy.process.plugins import SimplePlugin
 from git import Git, Repo
 from natsort import natsorted
+from lzproduction.utils.git_utils import fetch
 
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 Macro = namedtuple('Macro', ('name', 'path'))
 
 macro_dir_map = {'LUXSim': ['BackgroundMacros'],
                  'BACCARAT': ['BaccMacros', 'MDC1Macros', 'MDC2Macros']}
 
 
+class MacroIndex(object):
+    """
+    Persistent tag to macro index.
+
+    Maps each git tag to the macros available for each app in that tag.
+    The index is built from git tree listings so nothing is ever checked
+    out, only new tags need listing when updating and it is persisted to
+    disk so it survives restarts. Updates build a new index and swap it in
+    whole so that readers never need to lock.
+    """
+
+    def __init__(self, git_dir, index_file):
+        """
+        Initialisation.
+
+        Args:
+            git_dir (str): Path to the git repository
+            index_file (str): Path to the file used to persist the index
+        """
+        self.git_dir = git_dir
+        self.index_file = index_file
+        self._update_lock = threading.Lock()
+        self._index = ([], {})  # (tags, macros) swapped as one
+        self._load()
+
+    def _load(self):
+        """Load the index from disk."""
+        if not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'rb') as index_file:
+                macros = json.load(index_file)
+        except ValueError:
+            logger.warning("Ignoring corrupt macro index file %s", self.index_file)
+            return
+        self._set(macros)
+
+    def _save(self, macros):
+        """Atomically write the index to disk."""
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.index_file)))
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            json.dump(macros, tmp_file)
+        os.rename(tmp_path, self.index_file)
+
+    def _set(self, macros):
+        """Swap in a new index."""
+        self._index = (natsorted(macros, reverse=True),
+                       {tag: {app: [Macro(*macro) for macro in app_macros]
+                              for app, app_macros in apps.iteritems()}
+                        for tag, apps in macros.iteritems()})
+
+    def _list_macros(self, tag):
+        """List the macros of each app in a tag from the git tree."""
+        dirs = sorted(set(dir_ for dirs in macro_dir_map.itervalues() for dir_ in dirs))
+        paths = Git(self.git_dir).ls_tree('-r', '--name-only', tag, '--', *dirs).splitlines()
+        return {app: [(os.path.splitext(os.path.basename(path))[0], path)
+                      for path in sorted(paths)
+                      if path.endswith('.mac') and path.split('/', 1)[0] in app_dirs]
+                for app, app_dirs in macro_dir_map.iteritems()}
+
+    def update(self):
+        """
+        Update the index with the current repository tags.
+
+        Only tags not already in the index are listed.
+
+        Returns:
+            int: The number of new tags indexed
+        """
+        with self._update_lock:
+            tags = set(tag.name for tag in Repo(self.git_dir).tags)
+            indexed = self._index[1]
+            macros = {tag: apps for tag, apps in indexed.iteritems() if tag in tags}
+            new_tags = tags.difference(macros)
+            for tag in new_tags:
+                macros[tag] = self._list_macros(tag)
+            if new_tags or len(macros) != len(indexed):
+                self._save(macros)
+                self._set(macros)
+                logger.info("Indexed macros for %i new tags", len(new_tags))
+            return len(new_tags)
+
+    @property
+    def tags(self):
+        """Return the indexed tags, newest first."""
+        return self._index[0]
+
+    def macros(self, tag, app):
+        """
+        Get the macros for an app in a given tag.
+
+        Args:
+            tag (str): The git tag
+            app (str): The application name
+
+        Returns:
+            list: The Macros, or None if the tag is not indexed
+        """
+        return self._index[1].get(tag, {}).get(app)
+
+
+class GitRefresher(SimplePlugin):
+    """
+    Background git refresh plugin.
+
+    Periodically fetches the git repository and updates the macro index
+    in a background thread started and stopped with the CherryPy engine,
+    so that requests never wait on git. Failed refreshes are retried with
+    exponential backoff.
+    """
+
+    def __init__(self, bus, git_dir, macro_index, interval=300, max_backoff=3600):
+        """
+        Initialisation.
+
+        Args:
+            bus (cherrypy.process.wspbus.Bus): The CherryPy engine
+            git_dir (str): Path to the git repository
+            macro_index (MacroIndex): The index to keep up to date
+            interval (float): Time between refreshes (in secs)
+            max_backoff (float): Maximum time between retries of a
+                                 failing refresh (in secs)
+        """
+        super(GitRefresher, self).__init__(bus)
+        self.git_dir = git_dir
+        self.macro_index = macro_index
+        self.interval = interval
+        self.max_backoff = max(max_backoff, interval)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the refresh thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='GitRefresher')
+        self._thread.daemon = True
+        self._thread.start()
+        self.bus.log("Started git refresher for %s" % self.git_dir)
+    start.priority = 70
+
+    def stop(self):
+        """Stop the refresh thread."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.bus.log("Stopped git refresher for %s" % self.git_dir)
+
+    def refresh(self):
+        """Fetch the repository and update the macro index."""
+        fetch(self.git_dir, min_interval=0)
+        self.macro_index.update()
+
+    def _run(self):
+        """Refresh until stopped."""
+        failures = 0
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Exception refreshing git repository %s", self.git_dir)
+                failures += 1
+            else:
+                failures = 0
+            delay = min(self.interval * 2 ** failures, self.max_backoff)
+            self._stop_event.wait(delay * random.uniform(0.9, 1.1))
+
+
 @cherrypy.popargs('tagid', 'app')
 class GitTagMacros(object):
     """
@@ -22,40 +198,32 @@ class GitTagMacros(object):
     or returning list of available tags.
     """
 
-    def __init__(self, repo, git_dir, template_env):
-        """Initialisation."""
+    def __init__(self, repo, git_dir, template_env, index_file=None, refresh_interval=5):
+        """
+        Initialisation.
+
+        Args:
+            repo (str): The git repository url
+            git_dir (str): Path to the local clone
+            template_env (jinja2.Environment): The jinja2 html templating engine
+            index_file (str): Path to the file used to persist the macro index
+            refresh_interval (int): Time between background fetches (in mins)
+        """
         if not os.path.isdir(git_dir):
             Git().clone(repo, git_dir)
-        Git(git_dir).fetch()  # this introduces a slight delay if done in index. May be acceptible
         self.git_dir = git_dir
-        self.fs_lock = threading.Lock()
-        self.tag_cache = pylru.lrucache(50)
+        self.macro_index = MacroIndex(git_dir, index_file or git_dir.rstrip(os.sep) + '-macros.json')
+        self.refresher = GitRefresher(cherrypy.engine, git_dir, self.macro_index, refresh_interval * 60)
+        self.refresher.subscribe()
         self.template = template_env.get_template("html/gittags.html")
 
     @cherrypy.expose
     def index(self, tagid=None, app='LUXSim'):
         """Return the index page."""
-        print "IN GitTagMacro: tagid=(%s), app=(%s)" % (tagid, app)
-        cache_key = app + '::' + str(tagid)
-        if cache_key in self.tag_cache:
-            return self.tag_cache[cache_key]
-
         if tagid is None:
-            tags = natsorted((tag.name for tag in Repo(self.git_dir).tags), reverse=True)
-            return self.template.render({'tags': tags})
+            return self.template.render({'tags': self.macro_index.tags})
 
-        if app not in macro_dir_map:
+        macros = self.macro_index.macros(tagid, app)
+        if macros is None:
             return ''
-
-        with self.fs_lock:
-            Git(self.git_dir).checkout(tagid)
-            macros = (Macro(name=os.path.splitext(file_)[0],
-                            path=os.path.relpath(os.path.join(root, file_), self.git_dir))
-                      for macro_dir in macro_dir_map[app]
-                      for root, _, files in os.walk(os.path.join(self.git_dir, macro_dir))
-                      for file_ in files if file_.endswith('.mac'))
-
-            html = self.template.render({'macros': macros})
-            # print "returning:", str(html)
-            self.tag_cache[cache_key] = html
-            return html
+        return self.template.render({'macros': macros})
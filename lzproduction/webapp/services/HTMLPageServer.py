@@ -4,14 +4,17 @@ import logging
 from datetime import datetime
 import cStringIO
 import cherrypy
-from cherrypy.lib.static import serve_fileobj
+from sqlalchemy import func, false, String
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from lzproduction.sql.utils import db_session
-from lzproduction.sql.statuses import SERVICESTATUS
+from lzproduction.sql.statuses import SERVICESTATUS, LOCALSTATUS
 from lzproduction.sql.tables import Services, ParametricJobs, Users, Requests
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 MINS = 60
+CSV_HEADER = ['request_id', 'requester', 'request_date', 'sim_lead', 'description', 'detector',
+              'source', 'job_id', 'macro', 'app', 'app_version', 'njobs', 'nevents', 'seed',
+              'job_status', 'lfn']
 #SERVICE_COLOUR_MAP = {SERVICESTATUS.Up: 'brightgreen',
 #                      SERVICESTATUS.Down: 'red',
 #                      SERVICESTATUS.Unknown: 'lightgrey',
@@ -84,11 +87,60 @@ class HTMLPageServer(object):
 #                    request.status = "Submitted"
 
     @cherrypy.expose
-    def csv_export(self):
-        """Return .csv of Requests and ParametricJobs tables"""
+    def csv_export(self, start_date=None, end_date=None, status=None, requester=None):
+        """
+        Return .csv of Requests and ParametricJobs tables.
+
+        The rows are streamed in batches straight from the DB so that
+        memory use is flat and the download starts immediately.
+
+        Args:
+            start_date (str): [Optional] Only export requests made on or after
+                              this date (YYYY-MM-DD)
+            end_date (str): [Optional] Only export requests made on or before
+                            this date (YYYY-MM-DD)
+            status (str): [Optional] Comma separated list of request statuses
+                          to export
+            requester (str): [Optional] Only export requests from requesters
+                             whose name contains this
+        """
+        filters = []
+        # request_date is stored as DD/MM/YYYY so rearrange it to compare as YYYYMMDD.
+        request_date = func.substr(Requests.request_date, 7, 4, type_=String)\
+            + func.substr(Requests.request_date, 4, 2, type_=String)\
+            + func.substr(Requests.request_date, 1, 2, type_=String)
+        try:
+            if start_date:
+                filters.append(request_date >= datetime.strptime(start_date, '%Y-%m-%d').strftime('%Y%m%d'))
+            if end_date:
+                filters.append(request_date <= datetime.strptime(end_date, '%Y-%m-%d').strftime('%Y%m%d'))
+            if status:
+                filters.append(Requests.status.in_([LOCALSTATUS[name.strip()] for name in status.split(',')]))
+        except (ValueError, KeyError) as err:
+            raise cherrypy.HTTPError(400, 'Bad Request: Invalid export filter: %s' % err)
+
+        with db_session() as session:
+            names = {user_id: Users.name_from_dn(dn)
+                     for user_id, dn in session.query(Users.id, Users.dn).all()}
+        if requester:
+            requester_ids = [user_id for user_id, name in names.iteritems()
+                             if requester.lower() in name.lower()]
+            filters.append(Requests.requester_id.in_(requester_ids) if requester_ids else false())
+
+        cherrypy.response.headers['Content-Type'] = 'text/csv'
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="requests.csv"'
+        return self._csv_rows(filters, names)
+    csv_export._cp_config = {'response.stream': True}
+
+    @staticmethod
+    def _csv_rows(filters, names, batch_size=1000):
+        """Generate the export .csv in batches of rows."""
+        csvfile = cStringIO.StringIO()
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_HEADER)
         with db_session() as session:
             query = session.query(Requests.id,
-                                  Users,
+                                  Requests.requester_id,
                                   Requests.request_date,
                                   Requests.sim_lead,
                                   Requests.description,
@@ -102,24 +154,23 @@ class HTMLPageServer(object):
                                   ParametricJobs.nevents,
                                   ParametricJobs.seed,
                                   ParametricJobs.status,
-                                  ParametricJobs.outputdir_lfns)\
-                                  .join(ParametricJobs, Requests.id == ParametricJobs.request_id)\
-                                  .join(Users, Users.id == Requests.requester_id)\
-
-            if not query:
-                return "Error: No data"
-            rows = []
-            header = ['request_id', 'requester', 'request_date', 'sim_lead', 'description', 'detector', 'source', 'job_id', 'macro', 'app', 'app_version', 'njobs', 'nevents', 'seed', 'job_status', 'lfn']
-            csvfile = cStringIO.StringIO()
-            writer = csv.DictWriter(csvfile, header)
-        for request in query.all():
-            tmp = dict(zip(header, request))
-            tmp['requester'] = tmp['requester'].name
-            rows.append(tmp)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(
-                dict((k, v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems())
-            )
-        csvfile.seek(0)
-        return serve_fileobj(csvfile, disposition='attachment', content_type='text/csv', name='requests.csv')
+                                  ParametricJobs.sim_lfn_outputdir,
+                                  ParametricJobs.mctruth_lfn_outputdir,
+                                  ParametricJobs.reduction_lfn_outputdir,
+                                  ParametricJobs.der_lfn_outputdir,
+                                  ParametricJobs.lzap_lfn_outputdir)\
+                           .join(ParametricJobs, Requests.id == ParametricJobs.request_id)\
+                           .filter(*filters)\
+                           .order_by(Requests.id, ParametricJobs.id)\
+                           .yield_per(batch_size)
+            for i, row in enumerate(query, 1):
+                row = list(row[:15]) + [';'.join(lfn for lfn in row[15:] if lfn)]
+                row[1] = names.get(row[1], '')
+                row[14] = row[14].name
+                writer.writerow([value.encode('utf-8') if isinstance(value, unicode) else value
+                                 for value in row])
+                if not i % batch_size:
+                    yield csvfile.getvalue()
+                    csvfile.seek(0)
+                    csvfile.truncate()
+        yield csvfile.getvalue()
@@ -0,0 +1,63 @@
+"""Progress summary service."""
+import json
+import cherrypy
+from sqlalchemy import func
+from lzproduction.sql.utils import db_session
+from lzproduction.sql.tables import Users, ProgressSummaries
+
+
+class ProgressSummary(object):
+    """
+    Progress summary service.
+
+    Serves the job counts of each status from the ProgressSummaries
+    table as JSON, so that dashboards can show progress without counting
+    the DIRAC jobs. Users see their own requests, admins see everyone's.
+    """
+
+    @cherrypy.expose
+    def index(self, request_id=None):
+        """
+        Return the progress summary.
+
+        Args:
+            request_id (str): [Optional] The id of the request to summarise
+
+        Returns:
+            str: The JSON summary. If request_id is given the counts of the request
+                 under 'request' and of its parametric jobs keyed by id under
+                 'parametricjobs'. Otherwise the counts over all visible requests
+                 under 'total' and per user keyed by user id under 'users', each
+                 with the user's display name under 'name'.
+        """
+        user = cherrypy.request.verified_user
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        columns = ProgressSummaries.count_columns()
+        with db_session() as session:
+            if request_id is not None:
+                query = session.query(ProgressSummaries.parametricjob_id, *columns)\
+                               .filter_by(request_id=request_id)
+                if not user.admin:
+                    query = query.filter_by(requester_id=user.id)
+                rows = query.all()
+                return json.dumps({'request': ProgressSummaries.counts(next((row[1:] for row in rows
+                                                                             if row[0] is None),
+                                                                            [])),
+                                   'parametricjobs': {row[0]: ProgressSummaries.counts(row[1:])
+                                                      for row in rows if row[0] is not None}})
+
+            query = session.query(ProgressSummaries.requester_id, *(func.sum(column) for column in columns))\
+                           .filter_by(parametricjob_id=None)\
+                           .group_by(ProgressSummaries.requester_id)
+            if not user.admin:
+                query = query.filter_by(requester_id=user.id)
+            rows = query.all()
+            names = dict(session.query(Users.id, Users.dn)
+                         .filter(Users.id.in_([row[0] for row in rows]))
+                         .all()) if rows else {}
+
+        totals = [sum(row[i] or 0 for row in rows) for i in xrange(1, len(columns) + 1)]
+        return json.dumps({'total': ProgressSummaries.counts(totals),
+                           'users': {row[0]: dict(ProgressSummaries.counts(row[1:]),
+                                                  name=Users.name_from_dn(names[row[0]]))
+                                     for row in rows if row[0] in names}})
@@ -0,0 +1,269 @@
+"""Status update event service."""
+import json
+import time
+import logging
+import threading
+from Queue import Queue, Empty, Full
+from datetime import datetime, timedelta
+import cherrypy
+from cherrypy.process.plugins import SimplePlugin
+from sqlalchemy import or_
+from lzproduction.sql.utils import db_session
+from lzproduction.sql.tables import Requests, ParametricJobs, ProgressSummaries
+from lzproduction.sql.tables.ProgressSummaries import PROGRESS_STATUSES, local_column
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+# Each poll reaches back this far before the cursor so as not to miss rows
+# whose timestamps were truncated by the DB or that were committed late.
+CURSOR_OVERLAP = timedelta(seconds=5)
+
+
+class StatusEventBroadcaster(SimplePlugin):
+    """
+    Status change broadcast plugin.
+
+    A single background thread polls the DB for Requests and ParametricJobs
+    rows, and ParametricJobs progress summaries, whose timestamp has moved
+    on since the last poll, which includes every status update written by
+    the monitoring daemon, and broadcasts them as compact events to the
+    queue of each subscribed client.
+    """
+
+    def __init__(self, bus, interval=2, max_queued=100):
+        """
+        Initialisation.
+
+        Args:
+            bus (cherrypy.process.wspbus.Bus): The CherryPy engine
+            interval (float): Time between DB polls (in secs)
+            max_queued (int): Maximum number of undelivered event batches per
+                              client before the client is dropped
+        """
+        super(StatusEventBroadcaster, self).__init__(bus)
+        self.interval = interval
+        self.max_queued = max_queued
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._cursor = None
+        self._seen = set()
+
+    def start(self):
+        """Start the polling thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._cursor = datetime.utcnow()
+        self._seen = set()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='StatusEventBroadcaster')
+        self._thread.daemon = True
+        self._thread.start()
+        self.bus.log("Started status event broadcaster")
+    start.priority = 70
+
+    def stop(self):
+        """Stop the polling thread and end all client streams."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for queue in subscribers:
+            try:
+                queue.put_nowait(None)
+            except Full:
+                pass
+        self.bus.log("Stopped status event broadcaster")
+
+    def subscribe_client(self, max_clients=None):
+        """
+        Subscribe a client to the events.
+
+        Args:
+            max_clients (int): [Optional] Don't subscribe the client if there
+                               are already this many subscribers.
+
+        Returns:
+            Queue.Queue: The queue the client's event batches are put on. Each
+                         batch is a list of (requester_id, json event) tuples.
+                         None if there were already max_clients subscribers.
+        """
+        queue = Queue(self.max_queued)
+        with self._lock:
+            if max_clients is not None and len(self._subscribers) >= max_clients:
+                return None
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe_client(self, queue):
+        """Unsubscribe a client."""
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def is_subscribed(self, queue):
+        """Return whether a client queue is still subscribed."""
+        with self._lock:
+            return queue in self._subscribers
+
+    @property
+    def num_subscribers(self):
+        """Return the number of subscribed clients."""
+        with self._lock:
+            return len(self._subscribers)
+
+    def _poll(self):
+        """
+        Get the events for rows changed since the last poll.
+
+        Rows are selected from CURSOR_OVERLAP before the cursor so that
+        changes within the resolution of the DB timestamps, or committed
+        after the cursor moved past them, are not missed. Those already
+        sent are skipped.
+        """
+        since = self._cursor - CURSOR_OVERLAP
+        with db_session() as session:
+            requests = session.query(Requests.id,
+                                     Requests.requester_id,
+                                     Requests.status,
+                                     Requests.timestamp)\
+                              .filter(Requests.timestamp >= since)\
+                              .all()
+            parametricjobs = session.query(ParametricJobs.id,
+                                           ParametricJobs.request_id,
+                                           Requests.requester_id,
+                                           ParametricJobs.status,
+                                           ParametricJobs.reschedule,
+                                           ParametricJobs.timestamp,
+                                           ProgressSummaries.timestamp.label('counts_timestamp'),
+                                           *(getattr(ProgressSummaries, local_column(status))
+                                             for status in PROGRESS_STATUSES))\
+                                    .join(ParametricJobs.request)\
+                                    .outerjoin(ProgressSummaries,
+                                               ProgressSummaries.parametricjob_id == ParametricJobs.id)\
+                                    .filter(or_(ParametricJobs.timestamp >= since,
+                                                ProgressSummaries.timestamp >= since))\
+                                    .all()
+
+        events = []
+        seen = set()
+        cursor = self._cursor
+        for request in requests:
+            key = ('request', request.id, request.timestamp)
+            seen.add(key)
+            cursor = max(cursor, request.timestamp)
+            if key in self._seen:
+                continue
+            events.append((request.requester_id,
+                           json.dumps({'request_id': request.id,
+                                       'status': request.status.name})))
+        for job in parametricjobs:
+            timestamp = max(job.timestamp, job.counts_timestamp or job.timestamp)
+            key = ('parametricjob', job.id, timestamp)
+            seen.add(key)
+            cursor = max(cursor, timestamp)
+            if key in self._seen:
+                continue
+            events.append((job.requester_id,
+                           json.dumps({'request_id': job.request_id,
+                                       'parametricjob_id': job.id,
+                                       'status': job.status.name,
+                                       'reschedule': job.reschedule,
+                                       'counters': {status.name.lower():
+                                                    getattr(job, local_column(status)) or 0
+                                                    for status in PROGRESS_STATUSES}})))
+        # Only rows within the overlap of the new cursor can be selected again.
+        self._seen = set(key for key in seen if key[2] >= cursor - CURSOR_OVERLAP)
+        self._cursor = cursor
+        return events
+
+    def _broadcast(self, events):
+        """Put a batch of events on each client queue."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            try:
+                queue.put_nowait(events)
+            except Full:
+                logger.warning("Dropping slow status event client.")
+                self.unsubscribe_client(queue)
+
+    def _run(self):
+        """Poll and broadcast until stopped."""
+        while not self._stop_event.wait(self.interval):
+            if not self.num_subscribers:
+                # Nobody listening so just move the cursor on.
+                self._cursor = datetime.utcnow()
+                self._seen = set()
+                continue
+            try:
+                events = self._poll()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Exception polling for status events")
+                continue
+            if events:
+                self._broadcast(events)
+
+
+class StatusEvents(object):
+    """
+    Status events service.
+
+    Streams Requests and ParametricJobs status changes to the web UI as
+    Server-Sent Events. Each stream holds a server thread so the number
+    of clients is limited and streams are ended after max_age seconds,
+    browsers reconnecting automatically.
+    """
+
+    def __init__(self, broadcaster, max_clients=4, max_age=300, keepalive=15):
+        """
+        Initialisation.
+
+        Args:
+            broadcaster (StatusEventBroadcaster): The event source
+            max_clients (int): Maximum number of simultaneous streams
+            max_age (float): Time after which a stream is ended (in secs)
+            keepalive (float): Time between keep-alive comments (in secs)
+        """
+        self.broadcaster = broadcaster
+        self.max_clients = max_clients
+        self.max_age = max_age
+        self.keepalive = keepalive
+
+    @cherrypy.expose
+    def index(self):
+        """Return the event stream."""
+        user = cherrypy.request.verified_user
+        queue = self.broadcaster.subscribe_client(self.max_clients)
+        if queue is None:
+            raise cherrypy.HTTPError(503, 'Service Unavailable: Too many status event clients')
+
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        cherrypy.response.headers['X-Accel-Buffering'] = 'no'
+        return self._stream(queue, user.id, user.admin)
+    index._cp_config = {'response.stream': True, 'tools.gzip.on': False}
+
+    def _stream(self, queue, user_id, admin):
+        """Generate the event stream for a client."""
+        end = time.time() + self.max_age
+        try:
+            yield 'retry: 10000\n\n'
+            while time.time() < end:
+                try:
+                    events = queue.get(timeout=self.keepalive)
+                except Empty:
+                    if not self.broadcaster.is_subscribed(queue):
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+                if events is None:
+                    return
+                data = ''.join('data: %s\n\n' % event for requester_id, event in events
+                               if admin or requester_id == user_id)
+                if data:
+                    yield data
+        finally:
+            self.broadcaster.unsubscribe_client(queue)
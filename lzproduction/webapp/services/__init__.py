@@ -8,3 +8,5 @@ from .CVMFSAppVersions import CVMFSAppVersions
 from .GitTagMacros import GitTagMacros
 from .RequestsDBAPI import RequestsDBAPI
 from .Admins import Admins
+from .StatusEvents import StatusEvents, StatusEventBroadcaster
+from .ProgressSummary import ProgressSummary
@@ -28,6 +28,43 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--frequency', default=5, type=int,
                         help="The frequency that the daemon does it's main functionality (in mins) "
                              "[default: %(default)s]")
+    parser.add_argument('-s', '--submit-frequency', default=1, type=int,
+                        help="The frequency that the daemon checks for newly approved requests "
+                             "to submit (in mins) [default: %(default)s]")
+    parser.add_argument('-r', '--reschedule-frequency', default=1, type=int,
+                        help="The frequency that the daemon checks for failed requests marked "
+                             "for rescheduling (in mins) [default: %(default)s]")
+    parser.add_argument('-n', '--threads', default=1, type=int,
+                        help="The number of worker threads used to update requests and parametric "
+                             "jobs concurrently, 1 means update serially [default: %(default)s]")
+    parser.add_argument('--submit-threads', default=4, type=int,
+                        help="The maximum number of parametric jobs and DIRAC submission chunks "
+                             "of a request to submit concurrently, 1 means submit serially "
+                             "[default: %(default)s]")
+    parser.add_argument('--reset-chunk-size', default=1000, type=int,
+                        help="The maximum number of DIRAC jobs to kill and delete in a single "
+                             "RPC call when resetting failed submissions [default: %(default)s]")
+    parser.add_argument('--task-timeout', default=None, type=int,
+                        help="Maximum time (in mins) to wait for any one request or parametric "
+                             "job to update [default: %(default)s]")
+    parser.add_argument('-b', '--status-chunk-size', default=10000, type=int,
+                        help="The maximum number of DIRAC jobs to query the status of in a "
+                             "single RPC call [default: %(default)s]")
+    parser.add_argument('--delta-polling', action='store_true', default=False,
+                        help="Only fetch the DIRAC jobs whose status changed since the last "
+                             "cycle, with a periodic full resync.")
+    parser.add_argument('--full-resync', default=60, type=int,
+                        help="Time between full DIRAC status resyncs when delta polling "
+                             "(in mins) [default: %(default)s]")
+    parser.add_argument('--rpc-pool-size', default=10, type=int,
+                        help="The maximum number of simultaneous connections to the DIRAC RPC "
+                             "server [default: %(default)s]")
+    parser.add_argument('--db-pool-size', default=None, type=int,
+                        help="The number of DB connections kept open in the pool "
+                             "[default: 10]")
+    parser.add_argument('--db-max-overflow', default=None, type=int,
+                        help="The number of DB connections allowed beyond the pool size "
+                             "under load [default: 20]")
     parser.add_argument('-p', '--pid-file', default=os.path.join(lzprod_root, app_name + '.pid'),
                         help="The pid file used by the daemon [default: %(default)s]")
     parser.add_argument('-l', '--log-dir', default=os.path.join(lzprod_root, 'log'),
@@ -108,6 +145,18 @@ if __name__ == '__main__':
                               delay=args.frequency,
                               cert=(args.cert, args.key),
                               verify=args.verify,
+                              threads=args.threads,
+                              task_timeout=args.task_timeout,
+                              status_chunk_size=args.status_chunk_size,
+                              rpc_pool_size=args.rpc_pool_size,
+                              delta_polling=args.delta_polling,
+                              full_resync=args.full_resync,
+                              submit_delay=args.submit_frequency,
+                              reschedule_delay=args.reschedule_frequency,
+                              submit_threads=args.submit_threads,
+                              reset_chunk_size=args.reset_chunk_size,
+                              db_pool_size=args.db_pool_size,
+                              db_max_overflow=args.db_max_overflow,
                               app=app_name,
                               pid=args.pid_file,
                               logger=logger,
@@ -29,6 +29,9 @@ if __name__ == '__main__':
     parser.add_argument('-g', '--git-dir', default=os.path.join(lzprod_root, 'git', 'TDRAnalysis'),
                         help="Path to the directory where to clone TDRAnalysis git repo "
                              "[default: %(default)s]")
+    parser.add_argument('--git-refresh-interval', default=5, type=int,
+                        help="Time between background fetches of the git repo for new tags "
+                             "(in mins) [default: %(default)s]")
     parser.add_argument('-d', '--dburl',
                         default="sqlite:///" + os.path.join(lzprod_root, 'requests.db'),
                         help="URL for the requests DB. Note can use the prefix 'mysql+pymysql://' "
@@ -40,6 +43,15 @@ if __name__ == '__main__':
                         help="The host port to listen on [default: %(default)s]")
     parser.add_argument('-t', '--thread-pool', default=8, type=int,
                         help="The number of threads in the pool [default: %(default)s]")
+    parser.add_argument('--db-pool-size', default=None, type=int,
+                        help="The number of DB connections kept open in the pool "
+                             "[default: 10]")
+    parser.add_argument('--db-max-overflow', default=None, type=int,
+                        help="The number of DB connections allowed beyond the pool size "
+                             "under load [default: 20]")
+    parser.add_argument('--max-event-clients', default=4, type=int,
+                        help="The maximum number of simultaneous status event streams. Each "
+                             "holds a thread from the pool [default: %(default)s]")
     parser.add_argument('-i', '--pid-file', default=os.path.join(lzprod_root, 'webserver-daemon.pid'),
                         help="The pid file used by the daemon [default: %(default)s]")
     parser.add_argument('--debug-mode', action='store_true', default=False,
@@ -94,6 +106,10 @@ if __name__ == '__main__':
                                 thread_pool=args.thread_pool,
                                 git_repo=args.git_repo,
                                 git_dir=args.git_dir,
+                                git_refresh_interval=args.git_refresh_interval,
+                                max_event_clients=args.max_event_clients,
+                                db_pool_size=args.db_pool_size,
+                                db_max_overflow=args.db_max_overflow,
                                 app=app_name,
                                 pid=args.pid_file,
                                 logger=logger,